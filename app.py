@@ -1,10 +1,19 @@
-from flask import Flask, render_template, jsonify, Response, request
+from flask import Flask, render_template, jsonify, Response, request, abort
 from face_recognition import FaceLock
-import threading
+from embedders import create_embedder
+from embedding_worker import EmbeddingWorker
+from embedding_server import EmbeddingServer
+from embedding_cache import EmbeddingCache
+from scheduler import RecognitionScheduler
+from door_controller import DeadlineTimer, DoorController
+from shared_gallery import load_gallery
+from recorder import SessionRecorder
+import json
 import os
 import cv2
 import logging
 import requests
+import threading
 import time
 from datetime import datetime
 
@@ -27,191 +36,151 @@ if not os.path.exists(template_path):
 <!-- Copy the entire content of the index.html template here -->
 </html>''')
 
-face_lock = FaceLock()
-
-
-class DoorController:
-    def __init__(self):
-        self.status = "closed"
-        self.nodemcu_url = "http://192.168.0.105"  # Verified NodeMCU IP
-        self.timeout = 5
-        self.retry_attempts = 5
-        self.retry_delay = 1.0
-        self.last_command_time = 0
-        self.min_command_interval = 2.0
-        self.servo_movement_time = 1.5
-        self.auto_close_delay = 10.0  # 10 seconds before auto-closing
-        self.door_timer = None
-        
-    def verify_status(self):
-        """Verify door status with NodeMCU"""
-        try:
-            response = requests.get(
-                f"{self.nodemcu_url}/status",
-                timeout=self.timeout,
-                verify=False
-            )
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    self.status = data.get('status', self.status)
-                    logger.debug(f"Door status verified: {self.status}")
-                    return True
-                except ValueError:
-                    logger.error("Invalid JSON from NodeMCU status endpoint")
-            return False
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Status verification failed: {str(e)}")
-            return False
 
-    def check_connection(self):
-        """Check NodeMCU connectivity with detailed logging"""
-        try:
-            logger.debug(f"Checking connection to NodeMCU at {self.nodemcu_url}")
-            response = requests.get(
-                f"{self.nodemcu_url}/status",
-                timeout=self.timeout,
-                verify=False
-            )
-            
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    self.status = data.get('status', self.status)
-                    logger.info(f"NodeMCU connected, status: {self.status}")
-                    return True
-                except ValueError:
-                    logger.error("Invalid JSON response from NodeMCU")
-                    return False
-            else:
-                logger.error(f"NodeMCU returned status code: {response.status_code}")
-                return False
-                
-        except requests.exceptions.ConnectionError:
-            logger.error(f"Cannot connect to NodeMCU at {self.nodemcu_url}")
-            return False
-        except requests.exceptions.Timeout:
-            logger.error("Connection timeout")
-            return False
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Connection error: {str(e)}")
-            return False
+def load_server_config(path='doors.json'):
+    """Load the door/embedding configuration file"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.error(f"Invalid door config {path}: {str(e)}")
+        return {}
+
+
+def load_door_config(path='doors.json'):
+    """Load the camera -> door pairs served by this process"""
+    doors = load_server_config(path).get('doors', [])
+
+    if not doors:
+        # Single door, as before multi-door support
+        doors = [{"id": "main", "camera": 0, "nodemcu_url": "http://192.168.0.105"}]
+    return doors
+
+
+def create_embedding_worker(model_name, path='doors.json'):
+    """In-process embedding thread, or a process pool when 'embedding.workers' > 0"""
+    config = load_server_config(path).get('embedding', {})
+    if config.get('workers', 0) > 0:
+        return EmbeddingServer(
+            model_name=model_name,
+            num_workers=config['workers'],
+            threads_per_worker=config.get('threads_per_worker', 1),
+            max_batch_size=config.get('max_batch_size', 8),
+            max_latency=config.get('max_latency', 0.02),
+            pin_cpus=config.get('pin_cpus', True)
+        )
+    return EmbeddingWorker(create_embedder(model_name))
+
+
+# Recognition state, built by create_app()
+gallery = None
+embedding_worker = None
+embedding_cache = None
+recognition_scheduler = None
+session_recorder = None
+door_timer = None
+face_locks = {}
+door_controllers = {}
+default_door = None
+face_lock = None
+door_controller = None
+create_lock = threading.Lock()
+
+
+def create_app(path='doors.json', server_url=None):
+    """Build the gallery, embedding worker and doors (once) and return the Flask app.
+
+    Nothing is built at import: spawned embedding processes re-import the main
+    module and must not load a gallery or start door threads of their own.
+    serve.py and `python app.py` call this at startup; other WSGI hosts can
+    serve either `app:create_app()` or plain `app:app`, which builds on its
+    first request. server_url is where the FaceLocks post recognition events
+    (default: the config's 'server_url').
+    """
+    with create_lock:
+        if not face_locks:
+            build_doors(path, server_url)
+    return app
+
+
+def build_doors(path, server_url):
+    global gallery, embedding_worker, embedding_cache, recognition_scheduler, session_recorder
+    global door_timer, default_door, face_lock, door_controller
+    config = load_server_config(path)
+
+    # One gallery and one embedding model shared by every camera -> door pair.
+    # With gallery.shared_name set, every worker process maps the same published
+    # gallery (see shared_gallery.py) instead of unpickling its own copy.
+    gallery_config = config.get('gallery', {})
+    gallery = load_gallery(gallery_config.get('path', 'faces_trained.pkl'), gallery_config.get('shared_name'))
+    embedding_worker = create_embedding_worker(gallery.model_name, path)
+    embedding_cache = EmbeddingCache()
+
+    # One inference budget for all doors
+    recognition_scheduler = RecognitionScheduler.from_config(config.get('scheduler', {}))
+
+    recording_config = config.get('recording', {})
+    session_recorder = None
+    if recording_config.get('enabled', False):
+        session_recorder = SessionRecorder(
+            directory=recording_config.get('directory', 'recordings'),
+            mode=recording_config.get('mode', 'detections'),
+            max_width=recording_config.get('max_width', 640),
+            jpeg_quality=recording_config.get('jpeg_quality', 80)
+        )
+        session_recorder.start()
+
+    door_configs = load_door_config(path)
+    # One thread handles every door's auto-close deadline
+    door_timer = DeadlineTimer()
+    for door in door_configs:
+        face_locks[door['id']] = FaceLock(
+            door_id=door['id'],
+            camera=door.get('camera', 0),
+            gallery=gallery,
+            embedding_worker=embedding_worker,
+            embedding_cache=embedding_cache,
+            scheduler=recognition_scheduler,
+            recorder=session_recorder,
+            server_url=server_url or config.get('server_url', 'http://localhost:5000')
+        )
+        door_controllers[door['id']] = DoorController(
+            nodemcu_url=door.get('nodemcu_url', "http://192.168.0.105"),
+            auto_close_delay=door.get('auto_close_delay', 10.0),
+            timer=door_timer,
+            name=door['id']
+        )
 
-    def open_door(self):
-        """Open door with verification and retry logic"""
-        try:
-            # Prevent rapid consecutive commands
-            current_time = time.time()
-            if current_time - self.last_command_time < self.min_command_interval:
-                wait_time = self.min_command_interval - (current_time - self.last_command_time)
-                logger.info(f"Waiting {wait_time:.1f}s before next command")
-                time.sleep(wait_time)
-
-            # Verify connection first
-            if not self.check_connection():
-                logger.error("Cannot open door - NodeMCU not responding")
-                return False
-
-            # Send open command with retries
-            for attempt in range(self.retry_attempts):
-                try:
-                    logger.info(f"Sending open command (attempt {attempt + 1})")
-                    response = requests.get(
-                        f"{self.nodemcu_url}/open",
-                        timeout=self.timeout,
-                        verify=False
-                    )
-                    
-                    if response.status_code == 200:
-                        # Wait for servo movement
-                        time.sleep(self.servo_movement_time)
-                        
-                        # Verify door opened successfully
-                        if self.verify_status() and self.status == "open":
-                            self.last_command_time = time.time()
-                            logger.info("Door opened and verified")
-                            self.schedule_auto_close()
-                            return True
-                            
-                    logger.error(f"Open command failed (HTTP {response.status_code})")
-                    time.sleep(self.retry_delay)
-                    
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Open attempt {attempt + 1} failed: {str(e)}")
-                    time.sleep(self.retry_delay)
-                    
-            return False
-            
-        except Exception as e:
-            logger.error(f"Door control error: {str(e)}", exc_info=True)
-            return False
+    # The first configured door backs the original single-door endpoints
+    default_door = door_configs[0]['id']
+    face_lock = face_locks[default_door]
+    door_controller = door_controllers[default_door]
 
-    def close_door(self):
-        """Close door with verification and retry logic"""
-        try:
-            # Prevent rapid consecutive commands
-            current_time = time.time()
-            if current_time - self.last_command_time < self.min_command_interval:
-                wait_time = self.min_command_interval - (current_time - self.last_command_time)
-                logger.info(f"Waiting {wait_time:.1f}s before closing")
-                time.sleep(wait_time)
-
-            # Verify connection first
-            if not self.check_connection():
-                logger.error("Cannot close door - NodeMCU not responding")
-                return False
-
-            # Send close command with retries
-            for attempt in range(self.retry_attempts):
-                try:
-                    logger.info(f"Sending close command (attempt {attempt + 1})")
-                    response = requests.get(
-                        f"{self.nodemcu_url}/close",
-                        timeout=self.timeout,
-                        verify=False
-                    )
-                    
-                    if response.status_code == 200:
-                        # Wait for servo movement
-                        time.sleep(self.servo_movement_time)
-                        
-                        # Verify door closed successfully
-                        if self.verify_status() and self.status == "closed":
-                            self.last_command_time = time.time()
-                            logger.info("Door closed and verified")
-                            return True
-                            
-                    logger.error(f"Close command failed (HTTP {response.status_code})")
-                    time.sleep(self.retry_delay)
-                    
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Close attempt {attempt + 1} failed: {str(e)}")
-                    time.sleep(self.retry_delay)
-                    
-            return False
-            
-        except Exception as e:
-            logger.error(f"Door control error: {str(e)}", exc_info=True)
-            return False
 
-    def schedule_auto_close(self):
-        """Schedule automatic door closing"""
-        def auto_close():
-            logger.info("Auto-close timer triggered")
-            self.close_door()
-            self.door_timer = None
+@app.before_request
+def ensure_app():
+    """Build on first request when a WSGI host imported app:app without create_app()"""
+    if not face_locks:
+        create_app()
+
 
-        # Cancel any existing timer
-        if self.door_timer:
-            self.door_timer.cancel()
+def get_door(door_id):
+    """Return (face_lock, door_controller) for a door id or 404"""
+    if door_id not in face_locks:
+        abort(404, description=f"Unknown door: {door_id}")
+    return face_locks[door_id], door_controllers[door_id]
 
-        # Set new timer
-        self.door_timer = threading.Timer(self.auto_close_delay, auto_close)
-        self.door_timer.start()
-        logger.info(f"Door will auto-close in {self.auto_close_delay} seconds")
 
-# Initialize door controller
-door_controller = DoorController()
+def requested_doors():
+    """Doors selected by ?door=... or a JSON 'door' field, default all"""
+    data = request.get_json(silent=True) or {}
+    door_id = request.args.get('door') or data.get('door')
+    if door_id:
+        get_door(door_id)
+        return [door_id]
+    return list(face_locks)
 
 @app.route('/')
 def home():
@@ -219,20 +188,22 @@ def home():
 
 @app.route('/start', methods=['POST'])
 def start_recognition():
-    if not face_lock.running:
-        def run_face_lock():
-            face_lock.run()
-        
-        thread = threading.Thread(target=run_face_lock)
-        thread.start()
-        return jsonify({"status": "started", "message": "Face recognition started"})
+    started = [door_id for door_id in requested_doors() if face_locks[door_id].start()]
+
+    if started:
+        return jsonify({"status": "started", "message": "Face recognition started", "doors": started})
+    if any(face_locks[door_id].stopping for door_id in requested_doors()):
+        return jsonify({"status": "stopping", "message": "Face recognition is still stopping, try again"})
     return jsonify({"status": "already_running", "message": "Face recognition already running"})
 
 @app.route('/stop', methods=['POST'])
 def stop():
-    if face_lock.running:
-        face_lock.stop()
-        return jsonify({"status": "stopped", "message": "Face recognition stopped"})
+    # Don't join here: a request handler blocking on the recognition thread would
+    # stall gevent's hub, and with it the thread's own POST to /face_recognized
+    stopped = [door_id for door_id in requested_doors() if face_locks[door_id].stop(wait=False)]
+
+    if stopped:
+        return jsonify({"status": "stopped", "message": "Face recognition stopped", "doors": stopped})
     return jsonify({"status": "already_stopped", "message": "Face recognition not running"})
 
 @app.route('/face_recognized', methods=['POST'])
@@ -243,6 +214,14 @@ def face_recognized():
         name = data.get('name')
         confidence = data.get('confidence', 0.0)
         is_unknown = data.get('is_unknown', False)
+        door_id = data.get('door', default_door)
+
+        if door_id not in face_locks:
+            return jsonify({
+                "status": "error",
+                "message": f"Unknown door: {door_id}"
+            }), 404
+        face_lock, door_controller = face_locks[door_id], door_controllers[door_id]
 
         if not face_lock.running:
             return jsonify({
@@ -254,7 +233,8 @@ def face_recognized():
         if is_unknown or name == "Unknown":
             logger.info("Unknown face detected - ensuring door is closed")
             if door_controller.status == "open":
-                door_controller.close_door()
+                # Queued for the command thread; waiting here would stall the event loop
+                door_controller.close_door(wait=False)
             return jsonify({
                 "status": "warning",
                 "message": "Unknown face detected - door remains closed",
@@ -264,16 +244,23 @@ def face_recognized():
         # Log recognition details
         logger.info(f"Face recognition event: {name} ({confidence:.2%})")
 
-        # Only proceed if confidence is high enough
-        if confidence < 0.8:  # 80% threshold
+        # Only proceed if confidence clears the calibrated threshold for this person
+        threshold = gallery.threshold_for(name)
+        if confidence < threshold:
             return jsonify({
                 "status": "error",
                 "message": "Confidence too low",
-                "confidence": confidence
+                "confidence": confidence,
+                "threshold": threshold
             }), 400
 
-        # Verify NodeMCU connection
-        if not door_controller.check_connection():
+        # Hand the request to the door's command thread without waiting for the
+        # servo; if the door is already open this only extends the auto-close
+        # deadline, and repeated events share one command
+        logger.info(f"Opening door for {name}")
+        door_controller.open_door(wait=False)
+
+        if door_controller.connected is False:
             error_msg = "\n".join([
                 "NodeMCU not connected. Please check:",
                 "1. NodeMCU power and WiFi connection",
@@ -288,28 +275,14 @@ def face_recognized():
                 "last_status": door_controller.status
             }), 503
 
-        # Attempt door control
-        logger.info(f"Opening door for {name}")
-        success = door_controller.open_door()
-
-        if success:
-            # Schedule auto-close
-            door_controller.schedule_auto_close()
-            
-            return jsonify({
-                "status": "success",
-                "message": f"Door opened for {name}",
-                "door_status": door_controller.status,
-                "confidence": confidence,
-                "auto_close_in": door_controller.auto_close_delay,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-
         return jsonify({
-            "status": "error",
-            "message": "Failed to control door - Check hardware and network",
-            "door_status": door_controller.status
-        }), 500
+            "status": "success",
+            "message": f"Door {'open' if door_controller.status == 'open' else 'opening'} for {name}",
+            "door_status": door_controller.status,
+            "confidence": confidence,
+            "auto_close_in": door_controller.auto_close_remaining(),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        })
 
     except Exception as e:
         logger.error(f"Face recognition handler error: {str(e)}", exc_info=True)
@@ -318,21 +291,25 @@ def face_recognized():
             "message": str(e)
         }), 500
 
-def gen_frames():
+def gen_frames(face_lock, door_controller, frame_interval=1 / 30):
+    last_frame_count = -1
     while True:
-        if face_lock.running:
+        if face_lock.running and face_lock.frame_count != last_frame_count:
             try:
+                last_frame_count = face_lock.frame_count
                 frame = face_lock.current_frame
                 if frame is not None:
+                    # Draw on a copy; the recognition thread owns current_frame
+                    frame = frame.copy()
+
                     # Add door status overlay
                     status_text = f"Door: {door_controller.status}"
                     cv2.putText(frame, status_text, (10, 30), 
                               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
                     
                     # Add auto-close timer if door is open
-                    if door_controller.status == "open" and door_controller.door_timer:
-                        time_left = max(0, door_controller.auto_close_delay - 
-                                     (time.time() - door_controller.last_command_time))
+                    time_left = door_controller.auto_close_remaining()
+                    if door_controller.status == "open" and time_left is not None:
                         timer_text = f"Auto-close in: {time_left:.1f}s"
                         cv2.putText(frame, timer_text, (10, 70), 
                                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
@@ -345,19 +322,29 @@ def gen_frames():
             except Exception as e:
                 logger.error(f"Frame generation error: {str(e)}")
                 time.sleep(0.1)
+            # Cooperative under gevent: one greenlet per viewer, no thread pinned
+            time.sleep(frame_interval)
         else:
-            time.sleep(0.1)
+            time.sleep(frame_interval if face_lock.running else 0.1)
 
 @app.route('/door_status')
 def get_door_status():
     """Get current door status"""
+    return door_status(default_door)
+
+@app.route('/doors/<door_id>/status')
+def door_status(door_id):
+    """Get the status of one door and its camera"""
+    face_lock, door_controller = get_door(door_id)
     try:
         # Verify NodeMCU connection
         connection_status = door_controller.check_connection()
         
         return jsonify({
+            "door": door_id,
             "status": door_controller.status,
             "connected": connection_status,
+            "recognition_running": face_lock.running,
             "last_check": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         })
     except Exception as e:
@@ -481,7 +468,24 @@ def system_status():
             },
             "face_recognition": {
                 "running": face_lock.running,
-                "trained_faces": len(getattr(face_lock, 'known_names', []))
+                "trained_faces": len(gallery),
+                "embedding_worker": embedding_worker.stats,
+                "embedding_cache": embedding_cache.summary(),
+                "scheduler": recognition_scheduler.summary(),
+                "pending_crops": embedding_worker.pending(),
+                "recorder": session_recorder.stats if session_recorder is not None else None
+            },
+            "doors": {
+                door_id: {
+                    "camera": face_locks[door_id].camera,
+                    "nodemcu": door_controllers[door_id].nodemcu_url,
+                    "door_status": door_controllers[door_id].status,
+                    "auto_close_in": door_controllers[door_id].auto_close_remaining(),
+                    "commands_sent": door_controllers[door_id].commands_sent,
+                    "running": face_locks[door_id].running,
+                    "face_quality": face_locks[door_id].quality.summary()
+                }
+                for door_id in face_locks
             }
         })
     except Exception as e:
@@ -492,11 +496,69 @@ def system_status():
 @app.route('/video_feed')
 def video_feed():
     """Video streaming route"""
+    return door_video_feed(default_door)
+
+@app.route('/doors/<door_id>/video_feed')
+def door_video_feed(door_id):
+    """Video stream of one door's camera"""
     return Response(
-        gen_frames(),
+        gen_frames(*get_door(door_id)),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
 
+@app.route('/doors')
+def list_doors():
+    """List configured camera -> door pairs"""
+    return jsonify({
+        "default": default_door,
+        "doors": [
+            {
+                "id": door_id,
+                "camera": face_locks[door_id].camera,
+                "nodemcu_url": door_controllers[door_id].nodemcu_url,
+                "video_feed": f"/doors/{door_id}/video_feed",
+                "status": f"/doors/{door_id}/status"
+            }
+            for door_id in face_locks
+        ]
+    })
+
+def check_hardware():
+    """Verify every camera opens and probe every NodeMCU; returns False if a camera is missing"""
+    for door_id, lock in face_locks.items():
+        # Initialize video capture
+        cap = cv2.VideoCapture(lock.camera)
+        if not cap.isOpened():
+            logger.error(f"Cannot open camera {lock.camera} for door {door_id}!")
+            return False
+        cap.release()
+
+        # Test NodeMCU connection
+        try:
+            response = requests.get(
+                f"{door_controllers[door_id].nodemcu_url}/status",
+                timeout=2,
+                verify=False
+            )
+            logger.info(f"NodeMCU initial connection test ({door_id}): {response.status_code}")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Initial NodeMCU connection test failed ({door_id}): {e}")
+    return True
+
+def shutdown():
+    """Stop every recognition thread (releasing cameras), door timers and the embedding worker"""
+    for lock in face_locks.values():
+        lock.stop()
+    for controller in door_controllers.values():
+        controller.stop()
+    if door_timer is not None:
+        door_timer.stop()
+    if embedding_worker is not None:
+        embedding_worker.stop()
+    if session_recorder is not None:
+        session_recorder.stop()
+    logger.info("Shutdown complete")
+
 # Add main entry point
 if __name__ == '__main__':
     try:
@@ -510,25 +572,14 @@ if __name__ == '__main__':
         os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
         os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
         
-        # Initialize video capture
-        cap = cv2.VideoCapture(0)
-        if not cap.isOpened():
-            logger.error("Cannot open webcam!")
+        create_app()
+        if not check_hardware():
             exit(1)
-        cap.release()
-        
-        # Test NodeMCU connection
-        try:
-            response = requests.get(
-                f"{door_controller.nodemcu_url}/status",
-                timeout=2,
-                verify=False
-            )
-            logger.info(f"NodeMCU initial connection test: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Initial NodeMCU connection test failed: {e}")
-        
-        # Start Flask server
+
+        # Load the recognition stack in the background; door endpoints work meanwhile
+        embedding_worker.start()
+
+        # Start Flask development server (use serve.py in production)
         logger.info("Starting Flask server...")
         app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
         
@@ -536,5 +587,4 @@ if __name__ == '__main__':
         logger.error(f"Server startup error: {e}", exc_info=True)
     finally:
         # Cleanup
-        if face_lock.running:
-            face_lock.stop()
\ No newline at end of file
+        shutdown()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from embedding_server import EmbeddingServer
+
+
+def measure(model_name, workers, crops, cameras, max_batch_size, threads):
+    """Embed `crops` random face-sized crops from `cameras` sources -> crops per second"""
+    server = EmbeddingServer(model_name=model_name, num_workers=workers, threads_per_worker=threads,
+                             max_batch_size=max_batch_size, max_pending_per_source=crops)
+    server.start()
+    try:
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 255, (160, 160, 3), dtype=np.uint8) for _ in range(cameras)]
+
+        # Every process has to load its model before the clock starts
+        warm = [server.submit(f"warm-{i}", images[0]) for i in range(workers * max_batch_size)]
+        if any(future.result() is None for future in warm):
+            raise RuntimeError("embedding processes failed to start (see log)")
+
+        started = time.perf_counter()
+        futures = [server.submit(f"camera-{i % cameras}", images[i % cameras]) for i in range(crops)]
+        failed = sum(future.result() is None for future in futures)
+        elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+
+    if failed:
+        raise RuntimeError(f"{failed} of {crops} crops failed")
+    return crops / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure EmbeddingServer throughput per worker count")
+    parser.add_argument("--model", default="Facenet", help="Embedding model, as in the gallery's 'model'")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma-separated process counts")
+    parser.add_argument("--crops", type=int, default=512)
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=1, help="Intra-op threads per process")
+    parser.add_argument("--min-efficiency", type=float, default=0.7,
+                        help="Fail if crops/s falls below this fraction of linear scaling")
+    args = parser.parse_args()
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    print(f"{args.model}, {cores} cores, {args.crops} crops from {args.cameras} cameras, batch {args.batch}")
+
+    baseline = None
+    failed = False
+    for workers in (int(w) for w in args.workers.split(',')):
+        try:
+            rate = measure(args.model, workers, args.crops, args.cameras, args.batch, args.threads)
+        except RuntimeError as e:
+            print(f"workers={workers:<3} FAILED: {e}")
+            failed = True
+            continue
+
+        baseline = baseline or rate / workers
+        # Linear scaling is only expected up to the cores available
+        efficiency = rate / (baseline * min(workers, max(1, cores // args.threads)))
+        ok = efficiency >= args.min_efficiency
+        failed |= not ok
+        print(f"workers={workers:<3} {rate:8.1f} crops/s  x{rate / baseline:4.2f}  "
+              f"efficiency {efficiency:4.0%} {'ok' if ok else 'LOW'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import subprocess
+import sys
+import time
+
+# Modules that must stay off the startup path (loaded by the embedding worker instead)
+HEAVY_MODULES = ('tensorflow', 'deepface', 'sklearn', 'tf_keras', 'keras')
+
+# (module, budget in seconds)
+TARGETS = [
+    ('app', 1.0),
+    ('face_recognition', 0.8),
+    ('train_faces', 0.8),
+    ('export_embedder', 0.8),
+]
+
+
+def measure(module):
+    """Import a module in a fresh interpreter -> (seconds, heavy modules loaded, slowest imports)"""
+    code = (
+        f"import sys; import {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    # -X importtime lines: "import time: self | cumulative | name"
+    slowest = []
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if line.startswith('import time:') and len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2][1:].rstrip()  # Drop the separator space, keep depth indent
+            if name.startswith('  ') and not name.startswith('   '):  # Direct imports of the target
+                slowest.append((int(parts[1]) / 1e6, name.strip()))
+    slowest.sort(reverse=True)
+
+    heavy = [m for m in result.stdout.strip().split(',') if m]
+    return elapsed, heavy, slowest[:5]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check startup import time against a budget")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget (slow machines)")
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in TARGETS:
+        try:
+            elapsed, heavy, slowest = measure(module)
+        except RuntimeError as e:
+            print(f"{module:<20} FAILED to import: {e}")
+            failed = True
+            continue
+
+        budget *= args.scale
+        ok = elapsed <= budget and not heavy
+        failed |= not ok
+        print(f"{module:<20} {elapsed:6.2f}s (budget {budget:.2f}s) {'ok' if ok else 'OVER'}")
+        if heavy:
+            print(f"    heavy modules imported: {', '.join(heavy)}")
+        for seconds, name in slowest:
+            print(f"    {seconds:6.3f}s {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
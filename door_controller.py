@@ -0,0 +1,297 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Door states. OPENING/CLOSING mean a command is in flight.
+CLOSED = "closed"
+OPENING = "opening"
+OPEN = "open"
+CLOSING = "closing"
+
+
+class DeadlineTimer:
+    """One thread firing the deadlines of every door (heap ordered, re-armable by key)"""
+
+    def __init__(self):
+        self.heap = []  # (deadline, seq, key)
+        self.deadlines = {}  # key -> (deadline, seq, callback), latest wins
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def schedule(self, key, deadline, callback):
+        """Fire callback at deadline, replacing any deadline already set for key"""
+        with self.condition:
+            seq = next(self.seq)
+            self.deadlines[key] = (deadline, seq, callback)
+            heapq.heappush(self.heap, (deadline, seq, key))
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, name="door-timers", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def cancel(self, key):
+        with self.condition:
+            self.deadlines.pop(key, None)
+
+    def remaining(self, key, now=None):
+        """Seconds until key fires, or None if nothing is scheduled"""
+        entry = self.deadlines.get(key)
+        if entry is None:
+            return None
+        return max(0.0, entry[0] - (time.time() if now is None else now))
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.deadlines.clear()
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                callback = None
+                while self.running and callback is None:
+                    # Skip entries that were re-armed or cancelled
+                    while self.heap and self.deadlines.get(self.heap[0][2], (None, None))[1] != self.heap[0][1]:
+                        heapq.heappop(self.heap)
+                    if not self.heap:
+                        self.condition.wait()
+                        continue
+                    deadline, _, key = self.heap[0]
+                    wait = deadline - time.time()
+                    if wait > 0:
+                        self.condition.wait(wait)
+                        continue
+                    heapq.heappop(self.heap)
+                    callback = self.deadlines.pop(key)[2]
+                if not self.running:
+                    break
+
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Door timer callback error: {str(e)}", exc_info=True)
+
+
+class DoorController:
+    """State machine for one NodeMCU door.
+
+    Callers only state what they want (open or closed); a single command
+    thread drives the hardware towards it, one command at a time. Open
+    requests while the door is open or opening just push the auto-close
+    deadline back, and concurrent requests wait on the same in-flight
+    command instead of sending their own.
+    """
+
+    def __init__(self, nodemcu_url="http://192.168.0.105", auto_close_delay=10.0, timer=None, name="door"):
+        self.name = name
+        self.status = CLOSED
+        self.nodemcu_url = nodemcu_url  # Verified NodeMCU IP
+        self.timeout = 5
+        self.retry_attempts = 5
+        self.retry_delay = 1.0
+        self.last_command_time = 0
+        self.min_command_interval = 2.0
+        self.servo_movement_time = 1.5
+        self.auto_close_delay = auto_close_delay  # 10 seconds before auto-closing
+        self.timer = timer or DeadlineTimer()
+        self.connected = None  # Result of the last NodeMCU exchange
+        self.desired = None  # OPEN / CLOSED while a request is outstanding
+        self.commands_sent = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"door-{name}", daemon=True)
+        self.thread.start()
+
+    def _get_status(self):
+        """Ask the NodeMCU for the door state -> 'open' / 'closed', or None"""
+        response = requests.get(
+            f"{self.nodemcu_url}/status",
+            timeout=self.timeout,
+            verify=False
+        )
+        if response.status_code != 200:
+            logger.error(f"NodeMCU returned status code: {response.status_code}")
+            return None
+        try:
+            return response.json().get('status')
+        except ValueError:
+            logger.error("Invalid JSON response from NodeMCU")
+            return None
+
+    def _observe(self, hardware_status):
+        """Take the NodeMCU's view of the door unless a command is moving it"""
+        with self.condition:
+            if hardware_status and self.status not in (OPENING, CLOSING):
+                self.status = hardware_status
+
+    def verify_status(self):
+        """Verify door status with NodeMCU"""
+        try:
+            hardware_status = self._get_status()
+            self.connected = hardware_status is not None
+            self._observe(hardware_status)
+            if hardware_status:
+                logger.debug(f"Door status verified: {hardware_status}")
+            return hardware_status
+        except requests.exceptions.RequestException as e:
+            self.connected = False
+            logger.error(f"Status verification failed: {str(e)}")
+            return None
+
+    def check_connection(self):
+        """Check NodeMCU connectivity with detailed logging"""
+        try:
+            logger.debug(f"Checking connection to NodeMCU at {self.nodemcu_url}")
+            hardware_status = self._get_status()
+            self.connected = hardware_status is not None
+            if self.connected:
+                self._observe(hardware_status)
+                logger.info(f"NodeMCU connected, status: {self.status}")
+            return self.connected
+
+        except requests.exceptions.ConnectionError:
+            logger.error(f"Cannot connect to NodeMCU at {self.nodemcu_url}")
+        except requests.exceptions.Timeout:
+            logger.error("Connection timeout")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Connection error: {str(e)}")
+        self.connected = False
+        return False
+
+    def _request(self, target, wait, timeout):
+        with self.condition:
+            if self.desired is None and self.status == target:
+                if target == OPEN:
+                    self.schedule_auto_close()
+                return True
+
+            self.desired = target
+            self.condition.notify_all()
+            if not wait:
+                return True
+
+            # Done when the door gets there, or the request fails / is overridden
+            self.condition.wait_for(lambda: self.desired != target or
+                                    (self.status == target and self.desired is None), timeout)
+            return self.status == target
+
+    def open_door(self, wait=True, timeout=30.0):
+        """Open the door (or keep it open longer); returns True once it is open"""
+        if self.status in (OPEN, OPENING) and self.desired in (None, OPEN):
+            # Already open or on its way: only the auto-close deadline moves
+            self.schedule_auto_close()
+            if not wait or self.status == OPEN:
+                return True
+        return self._request(OPEN, wait, timeout)
+
+    def close_door(self, wait=True, timeout=30.0):
+        """Close the door; returns True once it is closed"""
+        self.timer.cancel(self)
+        return self._request(CLOSED, wait, timeout)
+
+    def _send_command(self, target):
+        """Send /open or /close with retries and verify; runs on the command thread only"""
+        command = "open" if target == OPEN else "close"
+        try:
+            # Prevent rapid consecutive commands
+            current_time = time.time()
+            if current_time - self.last_command_time < self.min_command_interval:
+                wait_time = self.min_command_interval - (current_time - self.last_command_time)
+                logger.info(f"Waiting {wait_time:.1f}s before next command")
+                time.sleep(wait_time)
+
+            for attempt in range(self.retry_attempts):
+                try:
+                    logger.info(f"Sending {command} command (attempt {attempt + 1})")
+                    self.commands_sent += 1
+                    response = requests.get(
+                        f"{self.nodemcu_url}/{command}",
+                        timeout=self.timeout,
+                        verify=False
+                    )
+                    self.connected = True
+                    self.last_command_time = time.time()
+
+                    if response.status_code == 200:
+                        # Wait for servo movement
+                        time.sleep(self.servo_movement_time)
+
+                        # Verify door moved successfully
+                        hardware_status = self._get_status()
+                        if hardware_status == target:
+                            logger.info(f"Door {target} and verified")
+                            return hardware_status
+
+                    logger.error(f"{command.capitalize()} command failed (HTTP {response.status_code})")
+                    time.sleep(self.retry_delay)
+
+                except requests.exceptions.RequestException as e:
+                    self.connected = False
+                    logger.error(f"{command.capitalize()} attempt {attempt + 1} failed: {str(e)}")
+                    time.sleep(self.retry_delay)
+
+            return None
+
+        except Exception as e:
+            logger.error(f"Door control error: {str(e)}", exc_info=True)
+            return None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (self.desired is None or self.desired == self.status):
+                    if self.desired is not None:
+                        # Reached without a command (e.g. opened while closing was queued)
+                        self.desired = None
+                        self.condition.notify_all()
+                    self.condition.wait()
+                if not self.running:
+                    break
+                target = self.desired
+                previous = self.status
+                self.status = OPENING if target == OPEN else CLOSING
+
+            reached = self._send_command(target)
+
+            with self.condition:
+                if reached == target:
+                    self.status = target
+                    if target == OPEN and self.desired == OPEN:
+                        self.schedule_auto_close()
+                else:
+                    self.status = previous
+                # A newer request (e.g. close while opening) keeps the loop going
+                if self.desired == target:
+                    self.desired = None
+                self.condition.notify_all()
+
+    def schedule_auto_close(self):
+        """Schedule automatic door closing, pushing back any earlier deadline"""
+        def auto_close():
+            logger.info("Auto-close timer triggered")
+            self.close_door(wait=False)
+
+        self.timer.schedule(self, time.time() + self.auto_close_delay, auto_close)
+        logger.info(f"Door will auto-close in {self.auto_close_delay} seconds")
+
+    def auto_close_remaining(self):
+        """Seconds until auto-close, or None when no close is scheduled"""
+        return self.timer.remaining(self)
+
+    def stop(self):
+        """Cancel the auto-close deadline and stop the command thread"""
+        self.timer.cancel(self)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join(timeout=5)
@@ -0,0 +1,210 @@
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = 'models'
+LITE_FORMATS = ('tflite', 'onnx')
+
+
+class DeepFaceEmbedder:
+    """Face embeddings through DeepFace.represent (one model per process)"""
+
+    def __init__(self, model_name='Facenet', detector_backend='opencv'):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+
+    def warm_up(self):
+        """Import DeepFace/TensorFlow and build the model ahead of the first face"""
+        from deepface import DeepFace
+        DeepFace.build_model(self.model_name)
+
+    def represent(self, img, detector_backend=None):
+        """Detect faces in a full image and embed them (DeepFace.represent output)"""
+        from deepface import DeepFace
+        results = DeepFace.represent(
+            img_path=img,
+            model_name=self.model_name,
+            detector_backend=detector_backend or self.detector_backend,
+            enforce_detection=True
+        )
+        if isinstance(results, dict):
+            results = [results]
+        return results
+
+    def embed(self, face_img):
+        """Return the embedding of a single face crop, or None"""
+        # Imported here so lite backends never load TensorFlow
+        from deepface import DeepFace
+        embedding = DeepFace.represent(
+            img_path=face_img,
+            model_name=self.model_name,
+            detector_backend=self.detector_backend,
+            enforce_detection=True,
+            align=True
+        )
+
+        if not embedding:
+            return None
+
+        return np.array(embedding[0]['embedding'], dtype=np.float32)
+
+    def embed_batch(self, face_imgs):
+        """Embed a list of face crops; crops that fail come back as None"""
+        embeddings = []
+        for face_img in face_imgs:
+            try:
+                embeddings.append(self.embed(face_img))
+            except Exception as e:
+                logger.debug(f"Embedding failed: {str(e)}")
+                embeddings.append(None)
+        return embeddings
+
+
+def preprocess_face(face_img, target_size=(160, 160)):
+    """Resize a BGR crop into the model input the way DeepFace does (pad, scale to [0, 1])"""
+    face_img = np.asarray(face_img)
+    h, w = face_img.shape[:2]
+    factor = min(target_size[0] / h, target_size[1] / w)
+    resized = cv2.resize(face_img, (max(1, int(w * factor)), max(1, int(h * factor))))
+
+    out = np.zeros((target_size[0], target_size[1], 3), dtype=np.float32)
+    top = (target_size[0] - resized.shape[0]) // 2
+    left = (target_size[1] - resized.shape[1]) // 2
+    out[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return out / 255.0
+
+
+class LiteEmbedder:
+    """Exported (TFLite / ONNX, optionally quantised) model run without TensorFlow.
+
+    The model name encodes the export, e.g. "Facenet-tflite-int8" is loaded
+    from models/Facenet-tflite-int8.tflite. Crops are expected to be face
+    boxes already (FaceLock passes Haar boxes), so no second detection runs.
+    """
+
+    def __init__(self, model_name, model_path=None, detector_backend='opencv'):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.format = next(fmt for fmt in LITE_FORMATS if f'-{fmt}' in model_name)
+        self.model_path = model_path or os.path.join(MODELS_DIR, f"{model_name}.{self.format}")
+        self.lock = threading.Lock()
+        self.face_cascade = None
+
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Exported model not found: {self.model_path} (run export_embedder.py)")
+
+        self.interpreter = None
+        self.session = None
+
+    def warm_up(self):
+        """Load the interpreter / session; deferred so importing the app stays light"""
+        with self.lock:
+            if self.interpreter is not None or self.session is not None:
+                return
+
+            if self.format == 'tflite':
+                try:
+                    from tflite_runtime.interpreter import Interpreter
+                except ImportError:
+                    import tensorflow as tf
+                    Interpreter = tf.lite.Interpreter
+                interpreter = Interpreter(model_path=self.model_path, num_threads=1)
+                interpreter.allocate_tensors()
+                self.input_detail = interpreter.get_input_details()[0]
+                self.output_detail = interpreter.get_output_details()[0]
+                self.input_size = tuple(self.input_detail['shape'][1:3])
+                self.batch_size = 1
+                self.interpreter = interpreter
+            else:
+                import onnxruntime as ort
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = 1
+                session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+                self.input_name = session.get_inputs()[0].name
+                shape = session.get_inputs()[0].shape
+                self.input_size = tuple(d if isinstance(d, int) else 160 for d in shape[1:3])
+                self.session = session
+
+            logger.info(f"Loaded {self.format} embedder from {self.model_path}")
+
+    def _forward_tflite(self, batch):
+        if batch.shape[0] != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_detail['index'], batch.shape)
+            self.interpreter.allocate_tensors()
+            self.input_detail = self.interpreter.get_input_details()[0]
+            self.output_detail = self.interpreter.get_output_details()[0]
+            self.batch_size = batch.shape[0]
+
+        if self.input_detail['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = self.input_detail['quantization']
+            batch = np.round(batch / scale + zero_point).astype(self.input_detail['dtype'])
+
+        self.interpreter.set_tensor(self.input_detail['index'], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_detail['index'])
+
+        if self.output_detail['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = self.output_detail['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    def embed_batch(self, face_imgs):
+        """Embed a list of face crops in one forward pass; bad crops come back as None"""
+        valid = [i for i, img in enumerate(face_imgs) if img is not None and np.asarray(img).size]
+        embeddings = [None] * len(face_imgs)
+        if not valid:
+            return embeddings
+
+        self.warm_up()
+        batch = np.stack([preprocess_face(face_imgs[i], self.input_size) for i in valid]).astype(np.float32)
+        with self.lock:
+            if self.format == 'tflite':
+                output = self._forward_tflite(batch)
+            else:
+                output = self.session.run(None, {self.input_name: batch})[0]
+
+        for i, embedding in zip(valid, np.asarray(output, dtype=np.float32)):
+            embeddings[i] = embedding
+        return embeddings
+
+    def embed(self, face_img):
+        """Return the embedding of a single face crop, or None"""
+        return self.embed_batch([face_img])[0]
+
+    def represent(self, img, detector_backend=None):
+        """Detect faces with OpenCV Haar and embed them (DeepFace.represent-like output)"""
+        if isinstance(img, str):
+            img = cv2.imread(img)
+        if self.face_cascade is None:
+            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        faces = self.face_cascade.detectMultiScale(gray, 1.1, 5)
+        if len(faces) == 0:
+            raise ValueError("Face could not be detected")
+
+        crops = [img[y:y+h, x:x+w] for (x, y, w, h) in faces]
+        return [
+            {
+                'embedding': embedding.tolist(),
+                'facial_area': {'x': int(x), 'y': int(y), 'w': int(w), 'h': int(h)},
+                'face_confidence': 1.0  # Haar gives no score
+            }
+            for (x, y, w, h), embedding in zip(faces, self.embed_batch(crops))
+        ]
+
+
+def is_lite_model(model_name):
+    return any(f'-{fmt}' in model_name for fmt in LITE_FORMATS)
+
+
+def create_embedder(model_name='Facenet', detector_backend='opencv'):
+    """Build the embedder matching the gallery's `model` field"""
+    if is_lite_model(model_name):
+        return LiteEmbedder(model_name, detector_backend=detector_backend)
+    return DeepFaceEmbedder(model_name=model_name, detector_backend=detector_backend)
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def dhash(face_img, hash_size=8):
+    """64-bit difference hash of a face crop (robust to small shifts and exposure changes)"""
+    gray = face_img if face_img.ndim == 2 else cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(hashes, value):
+    """Bit distance between each of an array of uint64 hashes and one hash"""
+    diff = np.bitwise_xor(hashes, np.uint64(value))
+    return np.unpackbits(diff.view(np.uint8)).reshape(len(hashes), -1).sum(axis=1)
+
+
+class EmbeddingCache:
+    """LRU/TTL cache of embeddings keyed by a perceptual hash of the crop and its box.
+
+    A lookup hits when a cached crop from the same camera has a dHash within
+    max_distance bits and a box of about the same place and size, so a person
+    standing still reuses one embedding instead of a model call per cycle.
+    Matching against the gallery is still done by the caller, so a retrained
+    gallery takes effect immediately.
+    """
+
+    def __init__(self, max_entries=256, ttl=5.0, max_distance=6, max_shift=0.25, max_scale=0.2):
+        self.max_entries = max_entries
+        self.ttl = ttl  # Seconds an embedding may be reused
+        self.max_distance = max_distance  # dHash bits out of 64
+        self.max_shift = max_shift  # Box centre shift, as a fraction of box width
+        self.max_scale = max_scale  # Relative change in box size
+        self.lru = OrderedDict()  # (source, id) -> (face_hash, box, embedding, created), oldest first
+        self.index = {}  # source -> (keys, hashes, boxes, created) arrays, rebuilt on put
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def key(self, face_img, box):
+        """Hash a crop once; pass the result to get() and put()"""
+        return dhash(face_img), tuple(int(v) for v in box)
+
+    def get(self, source, key, now=None):
+        """Return a cached embedding for a near-duplicate crop, or None"""
+        now = time.time() if now is None else now
+        face_hash, box = key
+
+        with self.lock:
+            index = self.index.get(source)
+            if index is not None:
+                keys, hashes, boxes, created = index
+                x, y, w, h = box
+                shift = np.hypot((boxes[:, 0] + boxes[:, 2] / 2) - (x + w / 2),
+                                 (boxes[:, 1] + boxes[:, 3] / 2) - (y + h / 2)) / max(w, 1)
+                scale = np.abs(boxes[:, 2] - w) / max(w, 1)
+                distance = hamming(hashes, face_hash)
+
+                ok = ((distance <= self.max_distance) & (shift <= self.max_shift) &
+                      (scale <= self.max_scale) & (now - created <= self.ttl))
+                if ok.any():
+                    cache_key = keys[int(np.argmin(np.where(ok, distance, 65)))]
+                    self.lru.move_to_end(cache_key)
+                    self.stats["hits"] += 1
+                    return self.lru[cache_key][2]
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, source, key, embedding, now=None):
+        if embedding is None:
+            return
+        now = time.time() if now is None else now
+        face_hash, box = key
+
+        with self.lock:
+            self.lru[(source, self.next_id)] = (face_hash, box, embedding, now)
+            self.next_id += 1
+
+            # Drop expired entries, then least recently used ones
+            for cache_key in [k for k, v in self.lru.items() if now - v[3] > self.ttl]:
+                del self.lru[cache_key]
+            while len(self.lru) > self.max_entries:
+                self.lru.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._reindex()
+
+    def _reindex(self):
+        """Rebuild the per-camera arrays searched by get()"""
+        grouped = {}
+        for cache_key, value in self.lru.items():
+            grouped.setdefault(cache_key[0], []).append((cache_key, value))
+
+        self.index = {
+            source: (
+                [k for k, _ in items],
+                np.array([v[0] for _, v in items], dtype=np.uint64),
+                np.array([v[1] for _, v in items], dtype=np.float32).reshape(-1, 4),
+                np.array([v[3] for _, v in items], dtype=np.float64)
+            )
+            for source, items in grouped.items()
+        }
+
+    def clear(self):
+        with self.lock:
+            self.lru.clear()
+            self.index = {}
+
+    def summary(self):
+        """Stats plus hit rate, for /system_status"""
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, size=len(self.lru),
+                        hit_rate=self.stats["hits"] / lookups if lookups else 0.0)
@@ -0,0 +1,302 @@
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from embedding_worker import EmbeddingWorker
+
+logger = logging.getLogger(__name__)
+
+
+def _embedding_process(model_name, shm_name, slot_bytes, tasks, results, cpus, threads):
+    """Worker process: pinned to its own cores, owns one model, reads crops from shared memory"""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            logger.warning(f"Could not pin embedding process to CPUs {sorted(cpus)}: {str(e)}")
+
+    from embedders import create_embedder, is_lite_model
+
+    # Must be set before TensorFlow initialises its thread pools
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    if not is_lite_model(model_name):
+        # Lite exports run without TensorFlow; importing it would cost the RAM they save
+        try:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except (ImportError, RuntimeError):
+            pass
+    cv2.setNumThreads(1)
+
+    embedder = create_embedder(model_name)
+    embedder.warm_up()
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            batch_id, slots = task
+            # Lets the parent fail this batch if the process dies on it
+            results.put(("start", batch_id, os.getpid()))
+            crops = [
+                np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+                for slot, shape in slots
+            ]
+            try:
+                embeddings = embedder.embed_batch(crops)
+            except Exception as e:
+                logger.error(f"Embedding process error: {str(e)}")
+                embeddings = [None] * len(crops)
+            # Views into shared memory must go before the segment is closed
+            del crops
+
+            results.put(("done", batch_id, [
+                None if embedding is None else np.asarray(embedding, dtype=np.float32)
+                for embedding in embeddings
+            ]))
+    finally:
+        shm.close()
+
+
+class EmbeddingServer(EmbeddingWorker):
+    """Embedding worker backed by a pool of model processes.
+
+    Crops are copied once into a shared-memory slab (fixed-size slots) and
+    only slot indices travel through the task queue. Requests from all
+    cameras are batched round-robin, and a batch is dispatched when it is
+    full or its oldest crop has waited max_latency seconds. Batches held by
+    a process that died, or running longer than batch_timeout after a
+    process picked them up (model loading doesn't count), resolve to None
+    so callers retry instead of waiting forever.
+    """
+
+    def __init__(self, model_name='Facenet', num_workers=None, threads_per_worker=1,
+                 max_batch_size=8, max_latency=0.02, max_crop_side=320,
+                 max_pending_per_source=4, pin_cpus=True, batch_timeout=30.0):
+        super().__init__(None, max_batch_size=max_batch_size,
+                         max_pending_per_source=max_pending_per_source)
+        self.model_name = model_name
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.threads_per_worker = threads_per_worker
+        self.max_latency = max_latency
+        self.max_crop_side = max_crop_side
+        self.pin_cpus = pin_cpus
+        self.batch_timeout = batch_timeout
+
+        self.slot_bytes = max_crop_side * max_crop_side * 3
+        # Two batches in flight per worker keeps every process busy
+        self.num_slots = self.num_workers * max_batch_size * 2
+        self.free_slots = list(range(self.num_slots))
+        self.in_flight = {}  # batch_id -> (started_at or None, pid or None, [(slot, future), ...])
+        self.next_batch_id = 0
+
+        self.shm = None
+        self.processes = []
+        self.tasks = None
+        self.results = None
+        self.result_thread = None
+
+    def start(self):
+        """Spawn the worker processes and dispatcher (no-op if already running)"""
+        with self.condition:
+            if self.running:
+                return
+
+            ctx = mp.get_context('spawn')
+            self.shm = shared_memory.SharedMemory(create=True, size=self.num_slots * self.slot_bytes)
+            self.tasks = ctx.Queue()
+            self.results = ctx.Queue()
+
+            cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+            for i in range(self.num_workers):
+                # One core per intra-op thread, so a process's threads don't share a core
+                worker_cpus = {
+                    cpus[(i * self.threads_per_worker + t) % len(cpus)] for t in range(self.threads_per_worker)
+                } if self.pin_cpus and cpus else None
+                process = ctx.Process(
+                    target=_embedding_process,
+                    args=(self.model_name, self.shm.name, self.slot_bytes,
+                          self.tasks, self.results, worker_cpus, self.threads_per_worker),
+                    name=f"embedding-{i}",
+                    daemon=True
+                )
+                process.start()
+                self.processes.append(process)
+
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="embedding-dispatcher", daemon=True)
+            self.thread.start()
+            self.result_thread = threading.Thread(target=self._collect, name="embedding-results", daemon=True)
+            self.result_thread.start()
+            logger.info(f"Embedding server started with {self.num_workers} processes "
+                        f"x {self.threads_per_worker} threads")
+
+    def stop(self):
+        super().stop()
+        if self.shm is None:
+            return
+
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+        self.results.put(None)
+        if self.result_thread:
+            self.result_thread.join(timeout=5)
+            self.result_thread = None
+
+        with self.condition:
+            for _, _, entries in self.in_flight.values():
+                for _, future in entries:
+                    future.set_result(None)
+            self.in_flight.clear()
+            self.free_slots = list(range(self.num_slots))
+
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+    def _fit_crop(self, face_img):
+        """Downscale a crop so it fits in one shared-memory slot"""
+        face_img = np.asarray(face_img, dtype=np.uint8)
+        h, w = face_img.shape[:2]
+        scale = self.max_crop_side / max(h, w)
+        if scale < 1.0:
+            face_img = cv2.resize(face_img, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                  interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(face_img)
+
+    def _ready(self):
+        """True when a batch should be dispatched now"""
+        waiting = [q for q in self.queues.values() if q]
+        if waiting and not self.processes:
+            return True  # No model left: resolve right away
+        if not waiting or len(self.free_slots) < 1:
+            return False
+        if sum(len(q) for q in waiting) >= min(self.max_batch_size, len(self.free_slots)):
+            return True
+        oldest = min(q[0][2] for q in waiting)
+        return time.time() - oldest >= self.max_latency
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self._ready():
+                    waiting = [q[0][2] for q in self.queues.values() if q]
+                    if waiting and self.free_slots:
+                        # Sleep until the oldest crop hits its deadline
+                        self.condition.wait(max(0.0, min(waiting) + self.max_latency - time.time()))
+                    else:
+                        self.condition.wait()
+                if not self.running:
+                    # Release anyone still waiting
+                    for waiting in self.queues.values():
+                        while waiting:
+                            waiting.popleft()[1].set_result(None)
+                    break
+
+                if not self.processes:
+                    for _, future, _ in self._next_batch():
+                        future.set_result(None)
+                    continue
+
+                # Never pop more crops than there are slots to put them in
+                batch = self._next_batch(len(self.free_slots))
+                entries = []
+                slots = []
+                for face_img, future, _ in batch:
+                    slot = self.free_slots.pop()
+                    crop = self._fit_crop(face_img)
+                    view = np.ndarray(crop.shape, dtype=np.uint8, buffer=self.shm.buf,
+                                      offset=slot * self.slot_bytes)
+                    view[...] = crop
+                    del view
+                    entries.append((slot, future))
+                    slots.append((slot, crop.shape))
+
+                batch_id = self.next_batch_id
+                self.next_batch_id += 1
+                self.in_flight[batch_id] = (None, None, entries)
+
+            self.tasks.put((batch_id, slots))
+            self.stats["batches"] += 1
+            self.stats["crops"] += len(slots)
+
+    def _collect(self):
+        """Resolve futures as worker processes finish batches, and watch for dead or stuck ones"""
+        while True:
+            try:
+                message = self.results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break
+
+            kind, batch_id, payload = message
+            if kind == "start":
+                with self.condition:
+                    if batch_id in self.in_flight:
+                        _, _, entries = self.in_flight[batch_id]
+                        self.in_flight[batch_id] = (time.time(), payload, entries)
+                continue
+
+            self._finish(batch_id, payload)
+            self._check_workers()
+
+    def _finish(self, batch_id, embeddings=None):
+        """Free a batch's slots and resolve its futures (None when the batch was lost)"""
+        with self.condition:
+            _, _, entries = self.in_flight.pop(batch_id, (None, None, []))
+            for slot, _ in entries:
+                self.free_slots.append(slot)
+            self.condition.notify()
+
+        embeddings = embeddings or [None] * len(entries)
+        for (_, future), embedding in zip(entries, embeddings):
+            future.set_result(embedding)
+
+    def _check_workers(self):
+        """Drop dead processes and fail their batches; time out batches nobody returns"""
+        with self.condition:
+            if not self.running:
+                return
+            dead = [process for process in self.processes if not process.is_alive()]
+            for process in dead:
+                logger.error(f"Embedding process {process.name} exited with code {process.exitcode}")
+                self.processes.remove(process)
+            if dead and not self.processes:
+                logger.error("No embedding processes left; crops resolve to None")
+                self.condition.notify()
+
+            dead_pids = {process.pid for process in dead}
+            now = time.time()
+            lost = [
+                batch_id for batch_id, (started_at, pid, _) in self.in_flight.items()
+                if pid in dead_pids or (started_at is not None and now - started_at > self.batch_timeout) or
+                (not self.processes and pid is None)
+            ]
+
+        for batch_id in lost:
+            logger.warning(f"Embedding batch {batch_id} lost or timed out")
+            self._finish(batch_id)
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingWorker:
+    """Shared embedding thread that serves crops from every camera.
+
+    Each camera (source) gets its own bounded queue. Batches are filled
+    round-robin across sources so one busy entrance cannot starve the others.
+    """
+
+    def __init__(self, embedder, max_batch_size=8, max_pending_per_source=4):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_pending_per_source = max_pending_per_source
+        self.queues = OrderedDict()  # source -> deque of (face_img, future, submitted_at)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.stats = {"batches": 0, "crops": 0, "dropped": 0, "busy_time": 0.0}
+
+    def start(self):
+        """Start the worker thread (no-op if already running)"""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="embedding-worker", daemon=True)
+            self.thread.start()
+            logger.info("Embedding worker started")
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def submit(self, source, face_img):
+        """Queue a face crop for embedding; returns a Future of the embedding"""
+        future = Future()
+        with self.condition:
+            queue = self.queues.setdefault(source, deque())
+            # Keep only the freshest crops per camera
+            while len(queue) >= self.max_pending_per_source:
+                stale = queue.popleft()[1]
+                stale.set_result(None)
+                self.stats["dropped"] += 1
+            queue.append((face_img, future, time.time()))
+            self.condition.notify()
+        return future
+
+    def pending(self, source=None):
+        with self.condition:
+            if source is not None:
+                return len(self.queues.get(source, ()))
+            return sum(len(q) for q in self.queues.values())
+
+    def _next_batch(self, limit=None):
+        """Take up to limit (default max_batch_size) crops, one per source per pass"""
+        limit = self.max_batch_size if limit is None else min(limit, self.max_batch_size)
+        batch = []
+        while len(batch) < limit:
+            took = False
+            for queue in self.queues.values():
+                if queue and len(batch) < limit:
+                    batch.append(queue.popleft())
+                    took = True
+            if not took:
+                break
+
+        # Rotate so the next batch starts with a different camera
+        if self.queues:
+            self.queues.move_to_end(next(iter(self.queues)))
+        return batch
+
+    def _run(self):
+        # Load the recognition stack here so startup never waits on TensorFlow
+        started = time.time()
+        try:
+            self.embedder.warm_up()
+            logger.info(f"Embedding model ready in {time.time() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Embedding model warm-up failed: {str(e)}")
+
+        while True:
+            with self.condition:
+                while self.running and not any(self.queues.values()):
+                    self.condition.wait()
+                if not self.running:
+                    break
+                batch = self._next_batch()
+
+            started = time.time()
+            try:
+                embeddings = self.embedder.embed_batch([item[0] for item in batch])
+            except Exception as e:
+                logger.error(f"Embedding batch error: {str(e)}")
+                embeddings = [None] * len(batch)
+
+            for item, embedding in zip(batch, embeddings):
+                item[1].set_result(embedding)
+
+            self.stats["batches"] += 1
+            self.stats["crops"] += len(batch)
+            self.stats["busy_time"] += time.time() - started
+
+        # Release anyone still waiting
+        with self.condition:
+            for queue in self.queues.values():
+                while queue:
+                    queue.popleft()[1].set_result(None)
@@ -0,0 +1,163 @@
+import argparse
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+from embedders import MODELS_DIR, DeepFaceEmbedder, LiteEmbedder, preprocess_face
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def load_face_crops(dataset_path):
+    """Largest Haar face per image in an SD card style folder -> (crops, names)"""
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    crops, names = [], []
+
+    for person_name in sorted(os.listdir(dataset_path)):
+        person_path = os.path.join(dataset_path, person_name)
+        if not os.path.isdir(person_path):
+            continue
+        for image_file in sorted(os.listdir(person_path)):
+            if not image_file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                continue
+            img = cv2.imread(os.path.join(person_path, image_file))
+            if img is None:
+                continue
+            faces = face_cascade.detectMultiScale(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), 1.1, 5)
+            if len(faces) == 0:
+                continue
+            x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+            crops.append(img[y:y+h, x:x+w])
+            names.append(person_name)
+
+    logger.info(f"Loaded {len(crops)} face crops from {dataset_path}")
+    return crops, names
+
+
+def export_tflite(keras_model, output_path, quantize, calibration_crops):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantize in ('float16', 'int8', 'dynamic'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        input_size = tuple(keras_model.input_shape[1:3])
+
+        def representative_dataset():
+            for crop in calibration_crops[:200]:
+                yield [preprocess_face(crop, input_size)[np.newaxis].astype(np.float32)]
+
+        # Float in/out keeps the interpreter call identical; weights and activations are int8
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_onnx(keras_model, output_path, quantize):
+    import tensorflow as tf
+    import tf2onnx
+
+    input_size = tuple(keras_model.input_shape[1:3])
+    spec = (tf.TensorSpec((None, input_size[0], input_size[1], 3), tf.float32, name='input'),)
+    float_path = output_path if quantize == 'none' else output_path + '.float.onnx'
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, output_path=float_path)
+
+    if quantize != 'none':
+        # ONNX Runtime only does weight (dynamic) quantisation without a calibration reader
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(float_path, output_path, weight_type=QuantType.QInt8)
+        os.remove(float_path)
+
+
+def export(model_name, fmt, quantize, calibration_crops):
+    """Export a DeepFace model and return the model name to put in the gallery"""
+    from deepface import DeepFace
+
+    keras_model = DeepFace.build_model(model_name).model
+    export_name = f"{model_name}-{fmt}-{quantize}"
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    output_path = os.path.join(MODELS_DIR, f"{export_name}.{fmt}")
+
+    if fmt == 'tflite':
+        export_tflite(keras_model, output_path, quantize, calibration_crops)
+    else:
+        export_onnx(keras_model, output_path, quantize)
+
+    logger.info(f"Exported {model_name} to {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB)")
+    return export_name
+
+
+def normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def rank1_accuracy(embeddings, names):
+    """Leave-one-out nearest neighbour identification accuracy"""
+    similarities = embeddings @ embeddings.T
+    np.fill_diagonal(similarities, -np.inf)
+    nearest = np.argmax(similarities, axis=1)
+    names = np.asarray(names)
+    return float(np.mean(names[nearest] == names))
+
+
+def embed_all(embedder, crops):
+    started = time.perf_counter()
+    embeddings = embedder.embed_batch(crops)
+    elapsed = (time.perf_counter() - started) / max(len(crops), 1)
+    return embeddings, elapsed
+
+
+def compare(model_name, export_name, crops, names):
+    """Compare an exported backend against full-precision DeepFace on the same crops"""
+    reference, reference_time = embed_all(DeepFaceEmbedder(model_name), crops)
+    lite, lite_time = embed_all(LiteEmbedder(export_name), crops)
+
+    keep = [i for i, (r, l) in enumerate(zip(reference, lite)) if r is not None and l is not None]
+    if not keep:
+        logger.error("No crops could be embedded by both backends")
+        return
+
+    reference = normalize([reference[i] for i in keep])
+    lite = normalize([lite[i] for i in keep])
+    kept_names = [names[i] for i in keep]
+    agreement = np.sum(reference * lite, axis=1)
+
+    print(f"\nAccuracy comparison on {len(keep)} faces ({len(set(kept_names))} people)")
+    print(f"{'backend':<32}{'rank-1':>10}{'ms/face':>10}")
+    print(f"{model_name:<32}{rank1_accuracy(reference, kept_names):>10.2%}{reference_time * 1000:>10.1f}")
+    print(f"{export_name:<32}{rank1_accuracy(lite, kept_names):>10.2%}{lite_time * 1000:>10.1f}")
+    print(f"Embedding cosine vs reference: mean {agreement.mean():.4f}, min {agreement.min():.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a DeepFace embedding model to TFLite/ONNX")
+    parser.add_argument("--model", default="Facenet")
+    parser.add_argument("--format", choices=('tflite', 'onnx'), default='tflite')
+    parser.add_argument("--quantize", choices=('none', 'float16', 'int8', 'dynamic'), default='int8')
+    parser.add_argument("--dataset", default="SD_CARD", help="Faces for int8 calibration and the comparison")
+    parser.add_argument("--no-compare", action="store_true", help="Skip the accuracy comparison")
+    args = parser.parse_args()
+
+    if args.format == 'onnx' and args.quantize == 'float16':
+        parser.error("float16 export is only supported for tflite")
+
+    crops, names = load_face_crops(args.dataset)
+    export_name = export(args.model, args.format, args.quantize, crops)
+
+    if not args.no_compare:
+        compare(args.model, export_name, crops, names)
+
+    print(f"\nRetrain with: python train_faces.py --model {export_name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import os
+import threading
+from collections import Counter
+
+import cv2
+import numpy as np
+
+# Crops are compared at a fixed size so sharpness does not depend on distance
+PATCH_SIZE = 64
+
+
+def laplacian_variance(patches):
+    """Variance of the 4-neighbour Laplacian of an (N, H, W) stack of gray patches"""
+    p = patches.astype(np.float32)
+    lap = 4 * p[:, 1:-1, 1:-1] - p[:, :-2, 1:-1] - p[:, 2:, 1:-1] - p[:, 1:-1, :-2] - p[:, 1:-1, 2:]
+    return lap.reshape(len(p), -1).var(axis=1)
+
+
+class FaceQualityScorer:
+    """Cheap pre-embedding checks: size, sharpness, exposure and rough pose.
+
+    Defaults come from the SD_CARD images scaled to webcam size (run this
+    module on a dataset folder to print the distributions): 32 of the 33
+    Haar boxes pass, the blurry one being a partial lower-face box. Blur is
+    judged on the downscaled patch, so only small or heavily smeared crops
+    fail: about a fifth of copies blurred with a 9px motion kernel or a
+    sigma-2 Gaussian fall under min_sharpness.
+    """
+
+    def __init__(self, min_size=60, min_sharpness=120.0, min_brightness=40.0, max_brightness=215.0,
+                 min_contrast=18.0, max_roll=25.0, max_yaw=0.18, check_pose=True):
+        self.min_size = min_size  # Pixels, shorter box side
+        self.min_sharpness = min_sharpness  # Laplacian variance at PATCH_SIZE
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast  # Gray-level standard deviation
+        self.max_roll = max_roll  # Degrees, from the eye line
+        self.max_yaw = max_yaw  # Eye midpoint offset from box centre, fraction of width
+        self.check_pose = check_pose
+        self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+        self.rejections = Counter()
+        self.accepted = 0
+        self.lock = threading.Lock()
+
+    def estimate_pose(self, face_gray):
+        """(roll degrees, yaw offset) from the two eyes, or None if they are not both found"""
+        h, w = face_gray.shape[:2]
+        eyes = self.eye_cascade.detectMultiScale(face_gray[:h // 2], 1.1, 5, minSize=(w // 8, w // 8))
+        if len(eyes) < 2:
+            return None
+
+        # The two largest detections are the eyes
+        eyes = sorted(eyes, key=lambda e: e[2] * e[3], reverse=True)[:2]
+        (lx, ly), (rx, ry) = sorted((x + ew / 2, y + eh / 2) for x, y, ew, eh in eyes)
+        roll = np.degrees(np.arctan2(ry - ly, rx - lx))
+        yaw = ((lx + rx) / 2 - w / 2) / w
+        return roll, yaw
+
+    def assess(self, gray, boxes):
+        """Score each (x, y, w, h) box of a gray frame -> list of (score, reason); reason is None if usable"""
+        if len(boxes) == 0:
+            return []
+
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        patches = np.stack([
+            cv2.resize(gray[y:y+h, x:x+w], (PATCH_SIZE, PATCH_SIZE), interpolation=cv2.INTER_AREA)
+            for x, y, w, h in boxes
+        ])
+
+        size = np.minimum(boxes[:, 2], boxes[:, 3])
+        sharpness = laplacian_variance(patches)
+        flat = patches.reshape(len(patches), -1).astype(np.float32)
+        brightness = flat.mean(axis=1)
+        contrast = flat.std(axis=1)
+
+        reasons = np.full(len(boxes), None, dtype=object)
+        # Checked in order, so each crop is counted under its first failure
+        for name, failed in (
+            ("too_small", size < self.min_size),
+            ("too_dark", brightness < self.min_brightness),
+            ("too_bright", brightness > self.max_brightness),
+            ("low_contrast", contrast < self.min_contrast),
+            ("blurry", sharpness < self.min_sharpness),
+        ):
+            reasons[(reasons == None) & failed] = name  # noqa: E711 (elementwise)
+
+        # Sharper and larger is better, capped so a huge face does not always win
+        scores = (np.minimum(sharpness / (4 * self.min_sharpness), 1.0) *
+                  np.minimum(size / (2.0 * self.min_size), 1.0))
+
+        if self.check_pose:
+            for i in np.flatnonzero(reasons == None):  # noqa: E711
+                x, y, w, h = boxes[i]
+                pose = self.estimate_pose(gray[y:y+h, x:x+w])
+                if pose is None:
+                    continue
+                roll, yaw = pose
+                if abs(roll) > self.max_roll or abs(yaw) > self.max_yaw:
+                    reasons[i] = "off_angle"
+                else:
+                    # Slight preference for frontal crops
+                    scores[i] *= 1.0 - 0.5 * abs(yaw) / self.max_yaw
+
+        with self.lock:
+            for reason in reasons:
+                if reason is None:
+                    self.accepted += 1
+                else:
+                    self.rejections[reason] += 1
+
+        return [(float(score), reason) for score, reason in zip(scores, reasons)]
+
+    def summary(self):
+        with self.lock:
+            return {"accepted": self.accepted, "rejected": dict(self.rejections)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print face quality metrics for a dataset to tune thresholds")
+    parser.add_argument("dataset", nargs="?", default="SD_CARD")
+    parser.add_argument("--frame-width", type=int, default=640, help="Downscale images to webcam width first")
+    args = parser.parse_args()
+
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    scorer = FaceQualityScorer()
+    metrics = {"size": [], "sharpness": [], "brightness": [], "contrast": []}
+
+    for root, _, files in os.walk(args.dataset):
+        for image_file in sorted(files):
+            if not image_file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                continue
+            img = cv2.imread(os.path.join(root, image_file))
+            if img is None:
+                continue
+            scale = args.frame_width / img.shape[1]
+            if scale < 1:
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+            for x, y, w, h in face_cascade.detectMultiScale(gray, 1.3, 5):
+                patch = cv2.resize(gray[y:y+h, x:x+w], (PATCH_SIZE, PATCH_SIZE), interpolation=cv2.INTER_AREA)
+                metrics["size"].append(min(w, h))
+                metrics["sharpness"].append(laplacian_variance(patch[np.newaxis])[0])
+                metrics["brightness"].append(patch.mean())
+                metrics["contrast"].append(patch.std())
+                scorer.assess(gray, [(x, y, w, h)])
+
+    print(f"{len(metrics['size'])} faces")
+    print(f"{'metric':<12}{'p5':>10}{'p50':>10}{'p95':>10}")
+    for name, values in metrics.items():
+        if values:
+            p5, p50, p95 = np.percentile(values, [5, 50, 95])
+            print(f"{name:<12}{p5:>10.1f}{p50:>10.1f}{p95:>10.1f}")
+    print(f"With current thresholds: {scorer.summary()}")
+
+
+if __name__ == "__main__":
+    main()
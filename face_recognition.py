@@ -1,139 +1,244 @@
 import cv2
-import numpy as np
-from deepface import DeepFace
 import requests
 import os
-import pickle
+import threading
 import time
+from concurrent.futures import Future
 from datetime import datetime
-from sklearn.metrics.pairwise import cosine_similarity
 import logging
 
+from embedders import create_embedder
+from embedding_cache import EmbeddingCache
+from embedding_worker import EmbeddingWorker
+from face_quality import FaceQualityScorer
+from scheduler import SETTLED, RecognitionScheduler
+from gallery import Gallery
+from tracking import FaceTracker
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 class FaceLock:
-    def __init__(self):
+    def __init__(self, door_id='main', camera=0, gallery=None, embedding_worker=None,
+                 embedding_cache=None, scheduler=None, server_url='http://localhost:5000',
+                 quality_window=0.3, recorder=None):
+        self.door_id = door_id
+        self.camera = camera
+        self.server_url = server_url
+        self.request_timeout = 5.0  # Seconds for the recognition POST, so a stuck server can't hang the loop
         self.running = False
         self.current_frame = None
+        self.frame_count = 0  # Bumped for every published frame so streams skip repeats
+        self.thread = None
+        self.lock = threading.Lock()
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
-        # Load trained faces
-        try:
-            with open('faces_trained.pkl', 'rb') as f:
-                data = pickle.load(f)
-                self.known_encodings = data['embeddings']
-                self.known_names = data['names']
-                self.model_name = data.get('model', 'Facenet')
-                logger.info(f"Loaded {len(self.known_names)} trained faces")
-        except Exception as e:
-            logger.error(f"Failed to load trained faces: {str(e)}")
-            self.known_encodings = []
-            self.known_names = []
-            self.model_name = 'Facenet'
+        self.tracker = FaceTracker()
+        self.quality = FaceQualityScorer()
+        self.quality_window = quality_window  # Seconds to collect crops before embedding the best one
+
+        # Gallery and embedding worker are shared when several doors run in one process
+        self.gallery = gallery if gallery is not None else Gallery.load('faces_trained.pkl')
+        if embedding_worker is None:
+            embedding_worker = EmbeddingWorker(create_embedder(self.gallery.model_name))
+        self.embedding_worker = embedding_worker
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache()
+        # Shared across doors so they draw from one inference budget
+        self.scheduler = scheduler if scheduler is not None else RecognitionScheduler()
+        self.recorder = recorder  # Optional SessionRecorder, shared between doors
+        self.synchronous = False  # Wait for each embedding (replay), so results don't depend on speed
+
+    @property
+    def known_names(self):
+        return self.gallery.known_names
+
+    @property
+    def model_name(self):
+        return self.gallery.model_name
 
     def match_face(self, face_img):
         """Match detected face with trained data"""
         try:
-            # Get embedding for detected face
-            embedding = DeepFace.represent(
-                img_path=face_img,
-                model_name=self.model_name,
-                detector_backend='opencv',
-                enforce_detection=True,
-                align=True
-            )
+            self.embedding_worker.start()
+            h, w = face_img.shape[:2]
+            embedding = self.request_embedding(face_img, (0, 0, w, h)).result()
+            return self.gallery.match(embedding)
 
-            if not embedding:
-                return None, 0.0
+        except Exception as e:
+            logger.error(f"Face matching error: {str(e)}")
+            return None, 0.0
 
-            # Convert to numpy array for comparison
-            current_embedding = np.array(embedding[0]['embedding'])
-            
-            # Calculate similarities with known faces
-            similarities = cosine_similarity(
-                current_embedding.reshape(1, -1),
-                self.known_encodings
-            )[0]
+    def request_embedding(self, face_img, box, acquire=None, now=None):
+        """Future of a crop's embedding, served from the cache for near-duplicate crops.
 
-            # Find best match
-            best_match_idx = np.argmax(similarities)
-            confidence = similarities[best_match_idx]
+        acquire is asked for budget only when the model is really needed; if it
+        refuses, None is returned and nothing is queued.
+        """
+        key = self.embedding_cache.key(face_img, box)
+        embedding = self.embedding_cache.get(self.door_id, key, now)
+        if embedding is not None:
+            future = Future()
+            future.set_result(embedding)
+            return future
 
-            # Only return match if confidence is high enough
-            if confidence >= 0.8:  # 80% confidence threshold
-                return self.known_names[best_match_idx], confidence
-            
-            return None, confidence
+        if acquire is not None and not acquire():
+            return None
 
-        except Exception as e:
-            logger.error(f"Face matching error: {str(e)}")
-            return None, 0.0
+        future = self.embedding_worker.submit(self.door_id, face_img)
+        future.add_done_callback(lambda done: self.embedding_cache.put(self.door_id, key, done.result(), now))
+        return future
+
+    def collect_result(self, track, now=None):
+        """Pick up a finished embedding for a track.
+
+        Returns True when the door should hear about it: the track's first match
+        (or a changed name), and each periodic recheck of a settled track.
+        """
+        if track.pending is None or not track.pending.done():
+            return False
+
+        embedding = track.pending.result()
+        track.pending = None
+        track.last_embedding = embedding
+        name, confidence = self.gallery.match(embedding)
+        track.name, track.confidence = name, confidence
+        notify = name is not None and (name != track.last_result or track.state == SETTLED)
+        self.scheduler.record(track, name, now)
+        return notify
+
+    @property
+    def stopping(self):
+        """Stop was requested but the loop has not finished its frame yet"""
+        return not self.running and self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Start the recognition thread; returns False if it is running or still stopping"""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name=f"face-lock-{self.door_id}", daemon=True)
+            self.thread.start()
+            return True
 
     def run(self):
-        """Main face recognition loop"""
-        self.running = True
-        cap = cv2.VideoCapture(0)
-        last_recognition_time = 0
-        recognition_cooldown = 2.0  # Seconds between recognition attempts
+        """Main face recognition loop; runs while self.running (set by start(), or by a direct caller)"""
+        self.embedding_worker.start()
+        # Anything with read() (e.g. a recorder.ReplaySource) is used as the capture directly
+        cap = self.camera if hasattr(self.camera, 'read') else cv2.VideoCapture(self.camera)
+        clock = getattr(cap, 'clock', time.time)
+        if not cap.isOpened():
+            logger.error(f"[{self.door_id}] Cannot open camera {self.camera}")
+            self.running = False
+            return
 
         while self.running:
             ret, frame = cap.read()
             if not ret:
+                if not cap.isOpened():
+                    break  # Replay finished
+                time.sleep(0.01)
                 continue
 
-            self.current_frame = frame.copy()
-            current_time = time.time()
-
-            # Only attempt recognition after cooldown
-            if current_time - last_recognition_time >= recognition_cooldown:
-                try:
-                    # Detect faces
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
-
-                    for (x, y, w, h) in faces:
-                        # Extract and preprocess face
-                        face_img = frame[y:y+h, x:x+w]
-                        name, confidence = self.match_face(face_img)
-
-                        if name:
-                            # Draw green box for recognized face
-                            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                            text = f"{name} ({confidence:.2%})"
-                            cv2.putText(frame, text, (x, y-10),
-                                      cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-                            # Trigger door control
-                            self.handle_recognition(name, confidence)
-                            last_recognition_time = current_time
-                        else:
-                            # Draw red box for unknown face
-                            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
-                            cv2.putText(frame, "Unknown", (x, y-10),
-                                      cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-                except Exception as e:
-                    logger.error(f"Recognition error: {str(e)}")
+            current_time = clock()
+            raw_frame = frame.copy() if self.recorder is not None else None
+            embeddings, decisions = [], []
+
+            try:
+                # Detect and track faces
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+                tracks = self.tracker.update(faces, current_time)
+
+                for track in tracks:
+                    finished = track.pending is not None and track.pending.done()
+                    notify = self.collect_result(track, current_time)
+                    if finished:
+                        embeddings.append((track.track_id, track.last_embedding))
+                    if notify:
+                        decisions.append((track.track_id, track.name, track.confidence))
+                        # Trigger door control
+                        self.handle_recognition(track.name, track.confidence)
+
+                # Only tracks due within a quality window collect crops, so the
+                # (eye cascade) quality checks skip faces waiting on a recheck
+                wanted = [track for track in tracks
+                          if self.scheduler.due(track, current_time + self.quality_window)]
+                qualities = self.quality.assess(gray, [track.box for track in wanted])
+
+                for track, (score, reason) in zip(wanted, qualities):
+                    x, y, w, h = track.box
+
+                    # Only usable crops compete for the next embedding
+                    if reason is None:
+                        track.offer_crop(lambda: frame[y:y+h, x:x+w].copy(), track.box, score, current_time)
+
+                # New tracks go straight away, later attempts wait for a full quality window
+                due = [
+                    track for track in tracks
+                    if track.best_crop is not None and self.scheduler.due(track, current_time) and
+                    (track.attempts == 0 or current_time - track.window_start >= self.quality_window)
+                ]
+                for track in sorted(due, key=self.scheduler.priority):
+                    future = self.request_embedding(
+                        track.best_crop, track.best_box,
+                        acquire=lambda: self.scheduler.acquire(track, current_time),
+                        now=current_time
+                    )
+                    if future is None:
+                        continue  # Over budget, the best crop waits for the next frame
+                    track.take_best()
+                    track.pending = future
+                    track.attempts += 1
+                    track.last_attempt = current_time
+                    if self.synchronous:
+                        future.result()
+
+                for track in tracks:
+                    x, y, w, h = track.box
+                    if track.name:
+                        # Draw green box for recognized face
+                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                        text = f"{track.name} ({track.confidence:.2%})"
+                        cv2.putText(frame, text, (x, y-10),
+                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+                    else:
+                        # Draw red box for unknown face
+                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
+                        cv2.putText(frame, "Unknown", (x, y-10),
+                                  cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+            except Exception as e:
+                logger.error(f"Recognition error: {str(e)}")
+                tracks = []
+
+            if self.recorder is not None:
+                self.recorder.record(self.door_id, self.frame_count, current_time, raw_frame,
+                                     [(track.track_id, track.box) for track in tracks],
+                                     embeddings, decisions)
 
             self.current_frame = frame
+            self.frame_count += 1
 
         cap.release()
+        self.running = False
+        logger.info(f"[{self.door_id}] Camera released")
 
     def handle_recognition(self, name, confidence):
         """Handle successful face recognition"""
         try:
             # Log recognition
-            logger.info(f"Recognized {name} with {confidence:.2%} confidence")
+            logger.info(f"[{self.door_id}] Recognized {name} with {confidence:.2%} confidence")
 
             # Send recognition event to server
             response = requests.post(
-                'http://localhost:5000/face_recognized',
+                f'{self.server_url}/face_recognized',
                 json={
                     'name': name,
+                    'door': self.door_id,
                     'confidence': float(confidence),
                     'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
+                },
+                timeout=self.request_timeout
             )
 
             if response.status_code == 200:
@@ -144,5 +249,16 @@ class FaceLock:
         except Exception as e:
             logger.error(f"Recognition handling error: {str(e)}")
 
-    def stop(self):
-        self.running = False
\ No newline at end of file
+    def stop(self, timeout=5.0, wait=True):
+        """Stop the recognition thread; with wait, also wait for the camera to be released"""
+        with self.lock:
+            was_running = self.running
+            self.running = False
+            thread = self.thread
+            if wait and thread is not None and thread is not threading.current_thread():
+                thread.join(timeout=timeout)
+                if thread.is_alive():
+                    logger.warning(f"[{self.door_id}] Recognition thread did not stop within {timeout}s")
+                else:
+                    self.thread = None
+            return was_running
@@ -0,0 +1,71 @@
+import logging
+import pickle
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Gallery:
+    """Trained face embeddings, loaded once and shared by every door"""
+
+    def __init__(self, embeddings, names, model_name='Facenet', threshold=0.8, thresholds=None):
+        self.known_encodings = embeddings
+        self.known_names = names
+        self.model_name = model_name
+        self.threshold = threshold  # Used when the gallery was trained without calibration
+        self.thresholds = thresholds or {}
+
+        # Unit-norm rows so cosine similarity is a single matrix-vector product
+        if len(names):
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            self.normalized = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        else:
+            self.normalized = np.zeros((0, 0), dtype=np.float32)
+
+    @classmethod
+    def load(cls, path='faces_trained.pkl'):
+        """Load the gallery written by train_faces.py"""
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            gallery = cls(data['embeddings'], data['names'], data.get('model', 'Facenet'),
+                          thresholds=data.get('thresholds'))
+            logger.info(f"Loaded {len(gallery.known_names)} trained faces")
+            if gallery.thresholds:
+                logger.info(f"Calibrated threshold {gallery.thresholds['global']:.3f} "
+                            f"(target FAR {gallery.thresholds.get('target_far', 0):.2%})")
+            return gallery
+        except Exception as e:
+            logger.error(f"Failed to load trained faces: {str(e)}")
+            return cls([], [])
+
+    def __len__(self):
+        return len(self.known_names)
+
+    def threshold_for(self, name=None):
+        """Calibrated threshold for an identity, else the global one, else the legacy default"""
+        per_identity = self.thresholds.get('per_identity', {})
+        if name in per_identity:
+            return per_identity[name]
+        return self.thresholds.get('global', self.threshold)
+
+    def match(self, embedding):
+        """Return (name, confidence) of the best match, name is None below threshold"""
+        if embedding is None or not len(self.known_names):
+            return None, 0.0
+
+        # Calculate similarities with known faces
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        similarities = self.normalized @ (embedding / max(float(np.linalg.norm(embedding)), 1e-12))
+
+        # Find best match
+        best_match_idx = int(np.argmax(similarities))
+        confidence = float(similarities[best_match_idx])
+
+        # Only return match if confidence clears that identity's threshold
+        name = self.known_names[best_match_idx]
+        if confidence >= self.threshold_for(name):
+            return name, confidence
+
+        return None, confidence
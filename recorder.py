@@ -0,0 +1,326 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Segment files are a run of chunks: 4-byte little-endian length + pickled list of records
+CHUNK_HEADER = struct.Struct('<I')
+
+
+class SessionRecorder:
+    """Background writer of recognition sessions into segment files.
+
+    Every record holds one frame (a downsampled JPEG) with its face boxes, the
+    embeddings that finished on that frame and the decisions taken. Callers
+    only enqueue; JPEG encoding and disk writes happen on the writer thread,
+    in chunks. When the queue is full records are dropped, never the camera.
+    In "detections" mode frames without faces are not stored.
+    """
+
+    def __init__(self, directory='recordings', mode='detections', max_width=640, jpeg_quality=80,
+                 chunk_size=32, segment_records=2000, max_queue=256):
+        self.directory = directory
+        self.mode = mode
+        self.max_width = max_width
+        self.jpeg_quality = jpeg_quality
+        self.chunk_size = chunk_size
+        self.segment_records = segment_records
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"recorded": 0, "dropped": 0, "skipped": 0, "bytes": 0, "segments": 0}
+        self.session = time.strftime('%Y%m%d-%H%M%S')
+        self.segment = None
+        self.segment_count = 0
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="session-recorder", daemon=True)
+            self.thread.start()
+            logger.info(f"Recording sessions to {self.directory} ({self.mode})")
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            self.queue.put(None)
+        self.thread.join(timeout=10)
+
+    def record(self, door_id, frame_index, timestamp, frame, detections, embeddings=(), decisions=()):
+        """Queue one frame; frame is not copied, so pass one the caller will not draw on"""
+        if not self.running:
+            return
+        if self.mode == 'detections' and not detections and not decisions:
+            self.stats["skipped"] += 1
+            return
+
+        record = {
+            "door": door_id,
+            "frame": frame_index,
+            "t": timestamp,
+            "image": frame,
+            "detections": [(int(track_id), tuple(int(v) for v in box)) for track_id, box in detections],
+            "embeddings": [(int(track_id), np.asarray(e, dtype=np.float32)) for track_id, e in embeddings],
+            "decisions": [(int(track_id), name, float(confidence)) for track_id, name, confidence in decisions]
+        }
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _encode(self, record):
+        frame = record.pop("image")
+        scale = min(1.0, self.max_width / frame.shape[1])
+        if scale < 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        record["jpeg"] = buffer.tobytes() if ok else None
+        record["scale"] = scale
+        return record
+
+    def _write(self, chunk):
+        if self.segment is None or self.segment_count >= self.segment_records:
+            if self.segment is not None:
+                self.segment.close()
+            path = os.path.join(self.directory, f"session-{self.session}-{self.stats['segments']:04d}.seg")
+            self.segment = open(path, 'ab')
+            self.segment_count = 0
+            self.stats["segments"] += 1
+
+        payload = pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)
+        self.segment.write(CHUNK_HEADER.pack(len(payload)) + payload)
+        self.segment.flush()
+        self.segment_count += len(chunk)
+        self.stats["recorded"] += len(chunk)
+        self.stats["bytes"] += len(payload) + CHUNK_HEADER.size
+
+    def _run(self):
+        chunk = []
+        while True:
+            try:
+                record = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                record = False  # Flush a partial chunk when things go quiet
+
+            if record:
+                try:
+                    chunk.append(self._encode(record))
+                except Exception as e:
+                    logger.error(f"Recorder encode error: {str(e)}")
+
+            if chunk and (record is None or record is False or len(chunk) >= self.chunk_size):
+                try:
+                    self._write(chunk)
+                except OSError as e:
+                    logger.error(f"Recorder write error: {str(e)}")
+                chunk = []
+
+            if record is None:
+                break
+
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+
+def read_segments(path):
+    """Yield records from a recording directory (or one segment file) in order"""
+    files = sorted(glob.glob(os.path.join(path, '*.seg'))) if os.path.isdir(path) else [path]
+    for segment_path in files:
+        with open(segment_path, 'rb') as f:
+            while True:
+                header = f.read(CHUNK_HEADER.size)
+                if len(header) < CHUNK_HEADER.size:
+                    break
+                payload = f.read(CHUNK_HEADER.unpack(header)[0])
+                try:
+                    chunk = pickle.loads(payload)
+                except Exception:
+                    logger.warning(f"Truncated chunk at the end of {segment_path}")
+                    break
+                for record in chunk:
+                    yield record
+
+
+class ReplaySource:
+    """cv2.VideoCapture stand-in that plays recorded frames back.
+
+    speed 0 replays as fast as the pipeline can take frames; 1.0 is real
+    time. clock() returns the recorded timestamp of the current frame, so
+    FaceLock's timing logic sees the original session's time line.
+    """
+
+    def __init__(self, path, door_id=None, speed=0.0):
+        self.records = (r for r in read_segments(path) if door_id is None or r["door"] == door_id)
+        self.speed = speed
+        self.current = None
+        self.started = None
+        self.first_t = None
+        self.frames = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        for record in self.records:
+            if record.get("jpeg") is None:
+                continue
+            frame = cv2.imdecode(np.frombuffer(record["jpeg"], dtype=np.uint8), cv2.IMREAD_COLOR)
+            if record.get("scale", 1.0) < 1.0:
+                frame = cv2.resize(frame, None, fx=1 / record["scale"], fy=1 / record["scale"])
+
+            if self.speed > 0:
+                if self.started is None:
+                    self.started, self.first_t = time.time(), record["t"]
+                delay = (record["t"] - self.first_t) / self.speed - (time.time() - self.started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.current = record
+            self.frames += 1
+            return True, frame
+
+        self.opened = False
+        return False, None
+
+    def clock(self):
+        return self.current["t"] if self.current else time.time()
+
+    def release(self):
+        self.opened = False
+
+
+def recorded_doors(path):
+    return sorted({record["door"] for record in read_segments(path)})
+
+
+def replay(path, door_id=None, speed=0.0, gallery_path=None, config_path='doors.json'):
+    """Run a recording through the FaceLock pipeline -> (decisions, per-door stats).
+
+    Each door is replayed on its own FaceLock (tracks never mix cameras) with
+    the scheduler settings of config_path, one door after the other; the
+    inference budget live doors share is therefore not contended in replay.
+    """
+    from app import load_server_config
+    from embedders import create_embedder
+    from embedding_worker import EmbeddingWorker
+    from face_recognition import FaceLock
+    from gallery import Gallery
+    from scheduler import RecognitionScheduler
+
+    config = load_server_config(config_path)
+    gallery = Gallery.load(gallery_path or config.get('gallery', {}).get('path', 'faces_trained.pkl'))
+    worker = EmbeddingWorker(create_embedder(gallery.model_name))
+    decisions = []
+
+    class ReplayFaceLock(FaceLock):
+        def handle_recognition(self, name, confidence):
+            # Record instead of opening a door
+            decisions.append((self.door_id, self.camera.current["frame"], name, float(confidence)))
+
+    stats = {}
+    for door in ([door_id] if door_id else recorded_doors(path)):
+        source = ReplaySource(path, door_id=door, speed=speed)
+        lock = ReplayFaceLock(door_id=door, camera=source, gallery=gallery, embedding_worker=worker,
+                              scheduler=RecognitionScheduler.from_config(config.get('scheduler', {})))
+        lock.synchronous = True  # Same results regardless of machine speed
+
+        crops = worker.stats["crops"]
+        started = time.perf_counter()
+        lock.running = True
+        lock.run()
+        elapsed = time.perf_counter() - started
+
+        stats[door] = {
+            "frames": source.frames,
+            "seconds": elapsed,
+            "fps": source.frames / elapsed if elapsed else 0.0,
+            "embeddings": worker.stats["crops"] - crops,
+            "cache": lock.embedding_cache.summary()
+        }
+    worker.stop()
+    return decisions, stats
+
+
+def recorded_decisions(path, door_id=None):
+    return [
+        (record["door"], record["frame"], name, confidence)
+        for record in read_segments(path) if door_id is None or record["door"] == door_id
+        for _, name, confidence in record["decisions"]
+    ]
+
+
+def diff_decisions(before, after, tolerance=5):
+    """Per-door/name counts plus the decisions with no partner (same door and name) within tolerance frames"""
+    unmatched = sorted((door, frame, name) for door, frame, name, _ in after)
+    only_before = []
+    for door, frame, name, _ in sorted(before, key=lambda d: (d[0], d[1])):
+        partner = next((d for d in unmatched
+                        if d[0] == door and d[2] == name and abs(d[1] - frame) <= tolerance), None)
+        if partner is None:
+            only_before.append((door, frame, name))
+        else:
+            unmatched.remove(partner)
+    return {
+        "before": dict(Counter(f"{door}/{name}" for door, _, name, _ in before)),
+        "after": dict(Counter(f"{door}/{name}" for door, _, name, _ in after)),
+        "only_before": only_before,
+        "only_after": unmatched
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded session through the FaceLock pipeline")
+    parser.add_argument("path", help="Recording directory or .seg file")
+    parser.add_argument("--door", help="Only replay this door's frames")
+    parser.add_argument("--speed", type=float, default=0.0, help="0 = as fast as possible, 1 = real time")
+    parser.add_argument("--gallery", help="Gallery to match against (default: the config's gallery)")
+    parser.add_argument("--config", default="doors.json", help="Server config whose scheduler settings are used")
+    parser.add_argument("--save", help="Write the replayed decisions to this JSON file")
+    parser.add_argument("--against", help="Diff against decisions saved by an earlier --save "
+                                          "(default: the decisions in the recording)")
+    parser.add_argument("--tolerance", type=int, default=5,
+                        help="Frames a decision may move and still count as the same")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    decisions, stats = replay(args.path, args.door, args.speed, args.gallery, args.config)
+
+    for door, door_stats in stats.items():
+        print(f"[{door}] Replayed {door_stats['frames']} frames in {door_stats['seconds']:.2f}s "
+              f"({door_stats['fps']:.1f} fps), {door_stats['embeddings']} model calls, "
+              f"cache hit rate {door_stats['cache']['hit_rate']:.1%}")
+
+    if args.against:
+        with open(args.against) as f:
+            baseline = [tuple(d) for d in json.load(f)["decisions"]]
+    else:
+        baseline = recorded_decisions(args.path, args.door)
+    print(json.dumps(diff_decisions(baseline, decisions, args.tolerance), indent=2))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({"stats": stats, "decisions": decisions}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@ import cv2
 import numpy as np
 import pickle
 from deepface import DeepFace
-from sklearn.metrics.pairwise import cosine_similarity
 
 # Load trained model
 with open('faces_trained.pkl', 'rb') as f:
@@ -10,10 +9,16 @@ with open('faces_trained.pkl', 'rb') as f:
 
 known_encodings = data['embeddings']
 known_names = data['names']
+# Unit-norm rows so matching a face is one matrix-vector product
+known_matrix = np.asarray(known_encodings, dtype=np.float32)
+known_matrix /= np.maximum(np.linalg.norm(known_matrix, axis=1, keepdims=True), 1e-12)
 model_name = data.get('model', 'Facenet')  # Default to Facenet if not specified
 
 # Recognition settings
-SIMILARITY_THRESHOLD = 0.65  # Adjust this based on your needs (higher = more strict)
+# Calibrated by train_faces.py; 0.65 for galleries trained before calibration (higher = more strict)
+thresholds = data.get('thresholds') or {}
+SIMILARITY_THRESHOLD = thresholds.get('global', 0.65)
+PER_IDENTITY_THRESHOLDS = thresholds.get('per_identity', {})
 DETECTOR_BACKEND = 'opencv'  # Options: 'opencv', 'ssd', 'dlib', 'mtcnn', 'retinaface'
 SHOW_CONFIDENCE = True  # Display confidence score
 
@@ -43,20 +48,14 @@ def recognize_face(face_img):
         current_embedding = np.array(result[0]['embedding'], dtype=np.float32)
         
         # Compare with known faces
-        best_match = "Unknown"
-        best_score = 0
-        
-        for known_embedding, name in zip(known_encodings, known_names):
-            similarity = cosine_similarity(
-                [current_embedding],
-                [known_embedding]
-            )[0][0]
-            
-            if similarity > best_score:
-                best_score = similarity
-                best_match = name
-        
-        return best_match, best_score
+        similarities = known_matrix @ (current_embedding / max(np.linalg.norm(current_embedding), 1e-12))
+        best_idx = int(np.argmax(similarities))
+        best_score = float(similarities[best_idx])
+
+        if best_score <= 0:
+            return "Unknown", 0
+
+        return known_names[best_idx], best_score
     
     except Exception as e:
         print(f"Recognition error: {e}")
@@ -94,7 +93,7 @@ while True:
             name, confidence = recognize_face(face_roi)
             
             # Draw results
-            if name and confidence > SIMILARITY_THRESHOLD:
+            if name and confidence >= PER_IDENTITY_THRESHOLDS.get(name, SIMILARITY_THRESHOLD):
                 color = (0, 255, 0)  # Green for recognized
                 label = f"{name} ({confidence:.2f})" if SHOW_CONFIDENCE else name
             else:
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import Counter
+
+# Track states, in scheduling priority order
+NEW = "new"
+UNCERTAIN = "uncertain"
+SETTLED = "settled"
+PRIORITY = {NEW: 0, UNCERTAIN: 1, SETTLED: 2}
+
+
+class RecognitionScheduler:
+    """Decides which tracks get an embedding, within a shared inference budget.
+
+    New faces are embedded immediately. Unknown or changing results are
+    retried with exponential backoff, and a face that matched the same name
+    settle_after times in a row is only rechecked every settled_interval.
+    All doors draw from one token bucket of max_per_second embeddings; as it
+    drains, settled rechecks are deferred first, then uncertain retries, so
+    new arrivals keep getting served under load.
+    """
+
+    def __init__(self, max_per_second=10.0, burst=None, base_interval=0.25, max_backoff=4.0,
+                 settle_after=2, settled_interval=5.0):
+        if max_per_second <= 0:
+            raise ValueError(f"max_per_second must be positive, got {max_per_second}")
+        self.max_per_second = max_per_second
+        # At least two tokens, so slow devices still have room for the priority reserves
+        self.capacity = max(2.0, burst or max_per_second)
+        self.tokens = self.capacity
+        self.last_refill = time.time()
+        self.base_interval = base_interval
+        self.max_backoff = max_backoff
+        self.settle_after = settle_after
+        self.settled_interval = settled_interval
+        self.lock = threading.Lock()
+        self.stats = {"granted": Counter(), "deferred": Counter()}
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the 'scheduler' section of doors.json"""
+        return cls(
+            max_per_second=config.get('max_embeddings_per_second', 10.0),
+            settled_interval=config.get('settled_interval', 5.0),
+            max_backoff=config.get('max_backoff', 4.0)
+        )
+
+    def priority(self, track):
+        return PRIORITY[track.state]
+
+    def due(self, track, now):
+        return track.pending is None and now >= track.next_attempt
+
+    def acquire(self, track, now=None):
+        """Take one embedding from the budget; lower priorities must leave a reserve"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.last_refill) * self.max_per_second)
+            self.last_refill = now
+
+            # Scaled to what is above the one token being taken, so it is always reachable
+            reserve = (self.capacity - 1.0) * 0.25 * self.priority(track)
+            if self.tokens >= 1.0 + reserve:
+                self.tokens -= 1.0
+                self.stats["granted"][track.state] += 1
+                return True
+
+            self.stats["deferred"][track.state] += 1
+            return False
+
+    def record(self, track, name, now=None):
+        """Update a track's state and next attempt time from a match result"""
+        now = time.time() if now is None else now
+        if name is None:
+            track.streak = 0
+            track.backoff = min(self.max_backoff, track.backoff * 2 if track.backoff else self.base_interval)
+            track.state = UNCERTAIN
+            track.next_attempt = now + track.backoff
+        elif name == track.last_result:
+            track.streak += 1
+            track.backoff = 0.0
+            if track.streak >= self.settle_after:
+                track.state = SETTLED
+                track.next_attempt = now + self.settled_interval
+            else:
+                track.next_attempt = now + self.base_interval
+        else:
+            # First match, or the name changed: confirm quickly
+            track.streak = 1
+            track.backoff = 0.0
+            track.state = UNCERTAIN
+            track.next_attempt = now + self.base_interval
+        track.last_result = name
+
+    def summary(self):
+        with self.lock:
+            return {
+                "tokens": round(self.tokens, 2),
+                "max_per_second": self.max_per_second,
+                "granted": dict(self.stats["granted"]),
+                "deferred": dict(self.stats["deferred"])
+            }
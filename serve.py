@@ -0,0 +1,70 @@
+# Production entry point: Flask behind gevent's WSGI server.
+# Must run before anything imports socket/ssl. Threads stay real OS threads
+# so the camera loops and the embedding worker keep running in parallel.
+# Only when run as a script: spawned embedding processes re-import this
+# module as __mp_main__ and must stay unpatched.
+if __name__ == "__main__":
+    from gevent import monkey
+    monkey.patch_all(thread=False)
+
+import argparse
+import logging
+import os
+import signal
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Suppress TensorFlow warnings
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '0')
+
+import app as door_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the face lock with gevent")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--autostart", action="store_true", help="Start recognition on every door at boot")
+    parser.add_argument("--skip-hardware-check", action="store_true")
+    args = parser.parse_args()
+
+    # Recognition events are posted back to this server
+    local_host = 'localhost' if args.host in ('0.0.0.0', '::', '') else args.host
+    door_app.create_app(server_url=f"http://{local_host}:{args.port}")
+    if not args.skip_hardware_check and not door_app.check_hardware():
+        raise SystemExit(1)
+
+    # Load the recognition stack in the background; door endpoints work meanwhile
+    door_app.embedding_worker.start()
+    if args.autostart:
+        for lock in door_app.face_locks.values():
+            lock.start()
+
+    # One greenlet per request/viewer instead of one thread
+    server = WSGIServer((args.host, args.port), door_app.app, log=None, error_log=logger)
+
+    def stop(signum):
+        logger.info(f"Received signal {signum}, shutting down")
+        server.stop(timeout=5)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        gevent.signal_handler(signum, stop, signum)
+
+    logger.info(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    finally:
+        # Stop recognition threads (releasing cameras), timers and embedding workers
+        door_app.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import logging
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from gallery import Gallery
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FGAL'
+# Control segment: magic, generation
+CONTROL = struct.Struct('<4sQ')
+# Data segment header: magic, generation, count, dim, metadata length
+HEADER = struct.Struct('<4sQIII')
+ALIGN = 64
+
+
+def _attach(name, create=False, size=0):
+    """Open a shared memory segment that outlives this process (not owned by its resource tracker)"""
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    try:
+        # Before Python 3.13 every attach is tracked and unlinked at exit
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+def _data_name(name, generation):
+    return f"{name}_g{generation}"
+
+
+def read_generation(control):
+    magic, generation = CONTROL.unpack_from(control.buf, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a face gallery control segment")
+    return generation
+
+
+def publish(gallery, name='face_gallery'):
+    """Publish a gallery as a new generation; returns the generation number.
+
+    The data segment is written completely before the control segment's
+    generation is bumped, so readers only ever see a finished gallery. The
+    previous generation is kept for readers still switching; older ones are
+    unlinked. Run one publisher at a time.
+    """
+    try:
+        control = _attach(f"{name}_ctl")
+        generation = read_generation(control) + 1
+    except FileNotFoundError:
+        control = _attach(f"{name}_ctl", create=True, size=CONTROL.size)
+        generation = 1
+
+    matrix = np.ascontiguousarray(gallery.normalized, dtype=np.float32)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(gallery), -1)
+    metadata = json.dumps({
+        "names": list(gallery.known_names),
+        "model": gallery.model_name,
+        "threshold": gallery.threshold,
+        "thresholds": gallery.thresholds
+    }).encode('utf-8')
+
+    offset = -(-(HEADER.size + len(metadata)) // ALIGN) * ALIGN
+    data = _attach(_data_name(name, generation), create=True, size=max(offset + matrix.nbytes, 1))
+    HEADER.pack_into(data.buf, 0, MAGIC, generation, matrix.shape[0], matrix.shape[1], len(metadata))
+    data.buf[HEADER.size:HEADER.size + len(metadata)] = metadata
+    np.ndarray(matrix.shape, dtype=np.float32, buffer=data.buf, offset=offset)[...] = matrix
+    data.close()
+
+    # Switch readers over
+    CONTROL.pack_into(control.buf, 0, MAGIC, generation)
+    control.close()
+
+    if generation > 2:
+        try:
+            # Plain attach: unlink() unregisters from the resource tracker itself
+            stale = shared_memory.SharedMemory(name=_data_name(name, generation - 2))
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+
+    logger.info(f"Published gallery generation {generation}: {len(gallery)} faces, "
+                f"{matrix.nbytes / 1024:.1f} KiB")
+    return generation
+
+
+class SharedGallery(Gallery):
+    """Read-only, zero-copy view of a published gallery.
+
+    The embedding matrix is a NumPy view straight onto the shared segment.
+    Every match checks the generation counter (one 8-byte read) and moves to
+    a newly published gallery between matches.
+    """
+
+    def __init__(self, name='face_gallery'):
+        self.name = name
+        self.control = _attach(f"{name}_ctl")
+        self.segment = None
+        self.previous = None
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Attach the latest generation if it changed; returns True on a switch"""
+        generation = read_generation(self.control)
+        if generation == self.generation:
+            return False
+
+        with self.lock:
+            if generation == self.generation:
+                return False
+            segment = _attach(_data_name(self.name, generation))
+            magic, _, count, dim, meta_len = HEADER.unpack_from(segment.buf, 0)
+            if magic != MAGIC:
+                raise ValueError(f"Bad gallery segment {segment.name}")
+            metadata = json.loads(bytes(segment.buf[HEADER.size:HEADER.size + meta_len]).decode('utf-8'))
+            offset = -(-(HEADER.size + meta_len) // ALIGN) * ALIGN
+            normalized = np.ndarray((count, dim), dtype=np.float32, buffer=segment.buf, offset=offset)
+            normalized.flags.writeable = False
+
+            # Swap everything match() reads in attribute assignments; the old
+            # mapping stays open because in-flight matches may still hold it
+            self.known_names = metadata["names"]
+            self.known_encodings = normalized
+            self.normalized = normalized
+            self.model_name = metadata["model"]
+            self.threshold = metadata["threshold"]
+            self.thresholds = metadata["thresholds"] or {}
+            self.previous, self.segment = self.segment, segment
+            self.generation = generation
+
+        logger.info(f"Attached gallery generation {generation} ({count} faces)")
+        return True
+
+    def match(self, embedding):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Gallery refresh failed, keeping generation {self.generation}: {str(e)}")
+        # Names and matrix must come from the same generation
+        with self.lock:
+            return super().match(embedding)
+
+
+def load_gallery(path='faces_trained.pkl', shared_name=None):
+    """Attach the shared gallery when one is published, else unpickle the file"""
+    if shared_name:
+        try:
+            return SharedGallery(shared_name)
+        except FileNotFoundError:
+            logger.warning(f"No shared gallery '{shared_name}' published; loading {path}")
+    return Gallery.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish a trained gallery into shared memory")
+    parser.add_argument("gallery", nargs="?", default="faces_trained.pkl")
+    parser.add_argument("--name", default="face_gallery")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    gallery = Gallery.load(args.gallery)
+    if not len(gallery):
+        raise SystemExit(f"No faces in {args.gallery}")
+    publish(gallery, args.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import numpy as np
+
+
+class Track:
+    """A face followed across frames by FaceTracker"""
+
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.name = None
+        self.confidence = 0.0
+        self.attempts = 0
+        self.last_attempt = 0.0
+        self.pending = None  # Future of an in-flight embedding
+        self.last_embedding = None
+        # Scheduling state, see scheduler.RecognitionScheduler
+        self.state = "new"
+        self.next_attempt = now
+        self.backoff = 0.0
+        self.streak = 0
+        self.last_result = None
+        # Best crop seen since the last embedding request
+        self.best_crop = None
+        self.best_box = None
+        self.best_score = 0.0
+        self.window_start = 0.0
+
+    def offer_crop(self, crop_fn, box, score, now):
+        """Keep the crop if it is the best of the current window (crop_fn copies lazily)"""
+        if self.best_crop is None:
+            self.window_start = now
+        if self.best_crop is None or score > self.best_score:
+            self.best_crop = crop_fn()
+            self.best_box = box
+            self.best_score = score
+
+    def take_best(self):
+        """Return (crop, box) of the window's best crop and start a new window"""
+        crop, box = self.best_crop, self.best_box
+        self.best_crop, self.best_box, self.best_score = None, None, 0.0
+        return crop, box
+
+
+def box_iou(boxes_a, boxes_b):
+    """Pairwise IoU of two (N, 4) / (M, 4) arrays of x, y, w, h boxes"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+
+    iw = np.minimum(ax2[:, None], bx2[None, :]) - np.maximum(a[:, 0][:, None], b[:, 0][None, :])
+    ih = np.minimum(ay2[:, None], by2[None, :]) - np.maximum(a[:, 1][:, None], b[:, 1][None, :])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+class FaceTracker:
+    """Greedy IoU association of detector boxes across frames"""
+
+    def __init__(self, iou_threshold=0.3, max_age=1.0):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age  # Seconds a track survives without a detection
+        self.tracks = []
+        self.next_id = 1
+
+    def update(self, boxes, now):
+        """Associate this frame's boxes with tracks; returns the tracks seen now"""
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        visible = []
+        unmatched = list(range(len(boxes)))
+
+        if self.tracks and boxes:
+            iou = box_iou([t.box for t in self.tracks], boxes)
+            # Best pairs first
+            for ti, bi in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[ti, bi] < self.iou_threshold:
+                    break
+                track = self.tracks[ti]
+                if track in visible or bi not in unmatched:
+                    continue
+                track.box = boxes[bi]
+                track.last_seen = now
+                track.hits += 1
+                visible.append(track)
+                unmatched.remove(bi)
+
+        for bi in unmatched:
+            track = Track(self.next_id, boxes[bi], now)
+            self.next_id += 1
+            self.tracks.append(track)
+            visible.append(track)
+
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age]
+        return visible
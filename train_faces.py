@@ -2,49 +2,62 @@ import os
 import cv2
 import numpy as np
 import pickle
-from deepface import DeepFace
+import argparse
+import json
 from pathlib import Path
 from tqdm import tqdm
 import logging
+from embedders import create_embedder
+from embedding_cache import dhash, hamming
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def far_threshold(scores, far):
+    """Lowest threshold that accepts at most a far fraction of scores"""
+    scores = np.sort(np.asarray(scores, dtype=np.float64))[::-1]
+    allowed = int(np.floor(far * len(scores)))
+    if allowed >= len(scores):
+        return float(scores[-1])
+    return float(np.nextafter(scores[allowed], np.inf))
+
 class FaceTrainer:
-    def __init__(self):
+    def __init__(self, model_name="Facenet"):
         self.known_encodings = []
         self.known_names = []
-        self.model_name = "Facenet"  # Can use "VGG-Face", "OpenFace", "ArcFace"
+        self.known_sources = []  # Image file of each encoding
+        self.model_name = model_name  # Can use "VGG-Face", "OpenFace", "ArcFace" or an export like "Facenet-tflite-int8"
         self.detector_backend = "opencv"  # Alternatives: "mtcnn", "retinaface"
         self.min_confidence = 0.8  # Minimum detection confidence
+        self.target_far = 0.01  # False-accept rate the match thresholds are calibrated for
+        self.dedup_distance = 4  # dHash bits; closer images of one person are burst duplicates
+        self.multi_face_policy = "largest"  # Or "skip": drop images with more than one face
+        self.outlier_z = 3.5  # Modified z-score (median/MAD) below which an embedding is an outlier
+        self.thresholds = None
+        self.calibration = None
+        self.embedder = create_embedder(self.model_name, self.detector_backend)
 
     def process_image(self, image_path):
-        """Extract face embeddings from an image"""
+        """Extract the embedding of the (single) face in an image"""
         try:
             # Read image
             img = cv2.imread(image_path)
             if img is None:
                 raise ValueError("Could not read image")
 
-            # Get face embeddings
-            results = DeepFace.represent(
-                img_path=image_path,
-                model_name=self.model_name,
-                detector_backend=self.detector_backend,
-                enforce_detection=True
-            )
-
-            # Handle single/multiple faces
-            if isinstance(results, dict):
-                results = [results]
-            
-            embeddings = []
-            for result in results:
-                if result['face_confidence'] >= self.min_confidence:
-                    embedding = np.array(result['embedding'], dtype=np.float32)
-                    embeddings.append(embedding)
-            
+            # Get face embeddings (single/multiple faces)
+            results = [r for r in self.embedder.represent(image_path)
+                       if r['face_confidence'] >= self.min_confidence]
+
+            # One face per image: a second face is someone else in the background
+            if len(results) > 1:
+                if self.multi_face_policy == "skip":
+                    logger.warning(f"Skipping {image_path}: {len(results)} faces")
+                    return []
+                results = [max(results, key=lambda r: r['facial_area']['w'] * r['facial_area']['h'])]
+
+            embeddings = [np.array(result['embedding'], dtype=np.float32) for result in results]
             return embeddings
 
         except Exception as e:
@@ -63,8 +76,9 @@ class FaceTrainer:
         
         for person_name in tqdm(person_folders, desc="Processing people"):
             person_path = os.path.join(dataset_path, person_name)
-            image_files = [f for f in os.listdir(person_path) 
-                          if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+            image_files = sorted(f for f in os.listdir(person_path) 
+                                 if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+            image_files = self.deduplicate(person_path, image_files)
             
             for image_file in tqdm(image_files, desc=f"Processing {person_name}", leave=False):
                 image_path = os.path.join(person_path, image_file)
@@ -74,17 +88,166 @@ class FaceTrainer:
                     for embedding in embeddings:
                         self.known_encodings.append(embedding)
                         self.known_names.append(person_name)
+                        self.known_sources.append(image_path)
+
+        self.prune_outliers()
+
+    def deduplicate(self, person_path, image_files):
+        """Drop near-duplicate burst shots (perceptual hash) before paying for embeddings"""
+        kept, hashes = [], []
+        for image_file in image_files:
+            img = cv2.imread(os.path.join(person_path, image_file))
+            if img is None:
+                kept.append(image_file)  # process_image reports unreadable files
+                continue
+            image_hash = dhash(img)
+            if hashes and hamming(np.array(hashes, dtype=np.uint64), image_hash).min() <= self.dedup_distance:
+                continue
+            kept.append(image_file)
+            hashes.append(image_hash)
+
+        if len(kept) < len(image_files):
+            logger.info(f"{os.path.basename(person_path)}: dropped {len(image_files) - len(kept)} "
+                        f"near-duplicate images, kept {len(kept)}")
+        return kept
+
+    def prune_outliers(self):
+        """Drop embeddings that do not look like the rest of their person (wrong face or label)"""
+        if not self.known_encodings:
+            return
+
+        embeddings = np.asarray(self.known_encodings, dtype=np.float32)
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        names = np.asarray(self.known_names)
+        people = sorted(set(self.known_names))
+
+        centroids = np.stack([embeddings[names == name].mean(axis=0) for name in people])
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        to_centroids = embeddings @ centroids.T
+        own = np.array([people.index(name) for name in self.known_names])
+        own_similarity = to_centroids[np.arange(len(own)), own]
+
+        keep = np.ones(len(own), dtype=bool)
+        for i, name in enumerate(people):
+            rows = np.flatnonzero(own == i)
+            if len(rows) < 3:
+                continue  # Too few samples to tell an outlier
+            scores = own_similarity[rows]
+            median = np.median(scores)
+            mad = np.median(np.abs(scores - median)) + 1e-6
+            keep[rows[0.6745 * (scores - median) / mad < -self.outlier_z]] = False
+
+        # Closer to someone else's centroid than to their own: likely mislabelled
+        if len(people) > 1:
+            keep &= np.argmax(to_centroids, axis=1) == own
+
+        for i in np.flatnonzero(~keep):
+            logger.warning(f"Dropping outlier {self.known_sources[i]} ({self.known_names[i]}, "
+                           f"similarity to own centroid {own_similarity[i]:.3f})")
+
+        self.known_encodings = [e for e, k in zip(self.known_encodings, keep) if k]
+        self.known_names = [n for n, k in zip(self.known_names, keep) if k]
+        self.known_sources = [p for p, k in zip(self.known_sources, keep) if k]
+
+    def calibrate(self):
+        """Compute match thresholds for target_far from the scores Gallery.match acts on.
+
+        The matcher takes the best similarity over the whole gallery, so every
+        embedding is scored as a probe against each identity's rows (its own row
+        left out): the best score against its own identity is genuine, the best
+        score against every other identity is an impostor attempt. The global
+        threshold keeps the best impostor identity of at most target_far of the
+        probes out; each identity gets the same rule over the probes of other
+        people scored against it, never looser than the global one. The reported
+        FAR/FRR are open-set identification rates at those thresholds.
+        """
+        embeddings = np.asarray(self.known_encodings, dtype=np.float32)
+        embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        names = np.asarray(self.known_names)
+        people = sorted(set(self.known_names))
+
+        if len(people) < 2:
+            logger.warning("Calibration needs at least two people; keeping the default threshold")
+            return None
+
+        similarities = embeddings @ embeddings.T
+        np.fill_diagonal(similarities, -np.inf)  # Leave-one-out
+        # Best similarity of each probe against each identity's gallery rows
+        scores = np.stack([similarities[:, names == name].max(axis=1) for name in people], axis=1)
+        own = np.searchsorted(people, names)
+        is_own = own[:, None] == np.arange(len(people))[None, :]
+
+        impostor = np.where(is_own, -np.inf, scores)
+        global_threshold = far_threshold(impostor.max(axis=1), self.target_far)
+        per_identity = {
+            name: max(global_threshold, far_threshold(scores[~is_own[:, i], i], self.target_far))
+            for i, name in enumerate(people)
+        }
+        thresholds = np.array([per_identity[name] for name in people])
+
+        # Genuine probe: accepted when its own identity wins and clears its threshold
+        has_genuine = np.isfinite(scores[is_own])
+        best = np.argmax(scores, axis=1)
+        accepted = (best == own) & (scores[np.arange(len(own)), best] >= thresholds[best])
+        # Impostor probe (its own identity not enrolled): accepted as whoever wins
+        best_impostor = np.argmax(impostor, axis=1)
+        false_accept = impostor[np.arange(len(own)), best_impostor] >= thresholds[best_impostor]
+
+        identities = {}
+        for i, name in enumerate(people):
+            rows = (own == i) & has_genuine
+            others = own != i
+            identities[name] = {
+                "samples": int(np.sum(own == i)),
+                "threshold": per_identity[name],
+                "genuine_mean": float(scores[rows, i].mean()) if rows.any() else None,
+                "frr": float(np.mean(~accepted[rows])) if rows.any() else None,
+                "far": float(np.mean(false_accept[others] & (best_impostor[others] == i)))
+            }
+
+        self.thresholds = {"global": global_threshold, "per_identity": per_identity,
+                           "target_far": self.target_far}
+        self.calibration = {
+            "genuine_probes": int(has_genuine.sum()),
+            "impostor_probes": int(len(own)),
+            "genuine_mean": float(scores[is_own][has_genuine].mean()) if has_genuine.any() else None,
+            "impostor_mean": float(impostor.max(axis=1).mean()),
+            "global_threshold": global_threshold,
+            "global_frr": float(np.mean(~accepted[has_genuine])) if has_genuine.any() else None,
+            "global_far": float(np.mean(false_accept)),
+            "identities": identities
+        }
+        return self.thresholds
+
+    def log_report(self):
+        """Log the calibration / evaluation report of this training run"""
+        report = self.calibration
+        if not report:
+            return
+        logger.info(f"Calibration for target FAR {self.target_far:.2%}: "
+                    f"{report['genuine_probes']} genuine / {report['impostor_probes']} impostor probes (1:N)")
+        logger.info(f"Global threshold {report['global_threshold']:.3f} "
+                    f"(FRR {report['global_frr'] or 0:.2%}, FAR {report['global_far']:.2%})")
+        for name, stats in report["identities"].items():
+            logger.info(f"  {name:<16} n={stats['samples']:<3} threshold {stats['threshold']:.3f} "
+                        f"FRR {stats['frr'] or 0:.2%} FAR {stats['far']:.2%}")
 
     def save_model(self, output_file="face_encodings.pkl"):
         """Save trained model to file"""
         if not self.known_encodings:
             raise ValueError("No face encodings to save")
 
+        if self.thresholds is None:
+            self.calibrate()
+
         data = {
             "embeddings": self.known_encodings,
             "names": self.known_names,
+            "sources": self.known_sources,
             "model": self.model_name,
             "detector": self.detector_backend,
+            "thresholds": self.thresholds,
+            "calibration": self.calibration,
             "timestamp": str(np.datetime64('now'))
         }
 
@@ -95,7 +258,27 @@ class FaceTrainer:
         logger.info(f"Total encodings: {len(self.known_encodings)}")
         logger.info(f"Unique people: {len(set(self.known_names))}")
 
+        self.log_report()
+        if self.calibration:
+            report_file = os.path.splitext(output_file)[0] + "_report.json"
+            with open(report_file, "w") as f:
+                json.dump(self.calibration, f, indent=2)
+            logger.info(f"Saved evaluation report to {report_file}")
+
 def main():
+    parser = argparse.ArgumentParser(description="Build faces_trained.pkl from an SD card folder per person")
+    parser.add_argument("--dataset", help="Folder with one sub-folder per person")
+    parser.add_argument("--model", default="Facenet",
+                        help="Embedding model, e.g. Facenet or Facenet-tflite-int8 (see export_embedder.py)")
+    parser.add_argument("--output", default="faces_trained.pkl")
+    parser.add_argument("--target-far", type=float, default=0.01,
+                        help="False-accept rate used to calibrate the match thresholds")
+    parser.add_argument("--multi-face", choices=("largest", "skip"), default="largest",
+                        help="What to do with images that contain more than one face")
+    parser.add_argument("--publish", metavar="NAME",
+                        help="Also publish the new gallery to running servers through shared memory")
+    args = parser.parse_args()
+
     # SD card path (modify as needed)
     sd_card_path = "/media/sd_card"  # Linux/Mac
     # sd_card_path = "D:\\"  # Windows
@@ -104,18 +287,27 @@ def main():
     fixed_path = r"c:\Users\HP\Desktop\datas\SD_CARD"
     
     # Initialize trainer
-    trainer = FaceTrainer()
+    trainer = FaceTrainer(model_name=args.model)
+    trainer.target_far = args.target_far
+    trainer.multi_face_policy = args.multi_face
     
     try:
+        if args.dataset:
+            trainer.train_from_folder(args.dataset)
         # Try to train from SD card first
-        if os.path.exists(sd_card_path):
+        elif os.path.exists(sd_card_path):
             trainer.train_from_folder(sd_card_path)
         else:
             # Fall back to fixed path
             trainer.train_from_folder(fixed_path)
         
         # Save the trained model
-        trainer.save_model("faces_trained.pkl")
+        trainer.save_model(args.output)
+
+        if args.publish:
+            from gallery import Gallery
+            from shared_gallery import publish
+            publish(Gallery.load(args.output), args.publish)
         
     except Exception as e:
         logger.error(f"Training failed: {str(e)}")